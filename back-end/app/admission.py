@@ -0,0 +1,245 @@
+# admission.py
+'''
+    Admission control for the expensive endpoints: caps on concurrent webcam sessions and in-flight uploads,
+    per-client token-bucket rate limits, and fast rejection (HTTP 429/503, websocket close 1013) with retry hints.
+'''
+
+import os
+import math
+import time
+import json
+from collections import OrderedDict
+
+# Websocket close code for "Try Again Later" (RFC 6455 registry)
+WS_TRY_AGAIN_LATER = 1013
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class Rejected(Exception):
+    '''
+        Exception that is raised when a request can't be admitted. Carries HTTP status and seconds the client should wait.
+    '''
+
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    '''
+        Classic token bucket: holds up to `burst` tokens and refills at `rate` tokens per second.
+    '''
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float, cost: float = 1.0):
+        '''
+            Tries to take `cost` tokens. Returns 0 on success, otherwise seconds until enough tokens are available.
+        '''
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+
+class RateLimiter:
+    '''
+        Per-key token buckets. Least recently used keys are evicted once `max_keys` is reached so memory stays bounded.
+    '''
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    def check(self, key: str, cost: float = 1.0):
+        '''
+            Returns 0 if request for key is allowed, otherwise seconds until it would be.
+        '''
+
+        if self.rate <= 0: return 0.0 # Rate limiting disabled
+
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+
+        return bucket.take(now, cost)
+
+
+class AdmissionController:
+    '''
+        Tracks current load and decides whether new webcam sessions and uploads are admitted.
+        All counters are only touched from the event loop so no locking is needed.
+    '''
+
+    def __init__(self, max_webcam_sessions: int, max_inflight: int, rate: float, burst: float, busy_retry_after: float):
+        self.max_webcam_sessions = max_webcam_sessions
+        self.max_inflight = max_inflight
+        self.busy_retry_after = busy_retry_after
+        self.limiter = RateLimiter(rate, burst)
+
+        self.webcam_sessions = 0
+        self.inflight = 0
+        self.rejected = {'rate_limited': 0, 'webcam_full': 0, 'inflight_full': 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_webcam_sessions=_env_int('MAX_WEBCAM_SESSIONS', 8),
+            max_inflight=_env_int('MAX_INFLIGHT_UPLOADS', 4),
+            rate=_env_float('CLIENT_RATE_PER_SEC', 0.0), # Off unless configured, see client_key()
+            burst=_env_float('CLIENT_RATE_BURST', 5.0),
+            busy_retry_after=_env_float('BUSY_RETRY_AFTER', 2.0)
+        )
+
+    def _check_rate(self, client: str):
+        wait = self.limiter.check(client)
+        if wait > 0:
+            self.rejected['rate_limited'] += 1
+            raise Rejected(429, 'Too many requests', wait)
+
+    def admit_webcam(self, client: str):
+        '''
+            Takes a webcam session slot. Raises Rejected if client is rate limited or all slots are taken.
+            Every successful call must be paired with release_webcam().
+        '''
+
+        self._check_rate(client)
+        if self.webcam_sessions >= self.max_webcam_sessions:
+            self.rejected['webcam_full'] += 1
+            raise Rejected(503, 'Webcam capacity reached', self.busy_retry_after)
+        self.webcam_sessions += 1
+
+    def release_webcam(self):
+        self.webcam_sessions -= 1
+
+    def admit_inflight(self, client: str):
+        '''
+            Takes an inference/LLM work slot. Raises Rejected if client is rate limited or all slots are taken.
+            Every successful call must be paired with release_inflight().
+        '''
+
+        self._check_rate(client)
+        if self.inflight >= self.max_inflight:
+            self.rejected['inflight_full'] += 1
+            raise Rejected(503, 'Inference capacity reached', self.busy_retry_after)
+        self.inflight += 1
+
+    def release_inflight(self):
+        self.inflight -= 1
+
+    def accepting(self):
+        return self.webcam_sessions < self.max_webcam_sessions or self.inflight < self.max_inflight
+
+    def load(self):
+        '''
+            Returns dict describing current load, meant for load balancer health checks.
+        '''
+
+        return {
+            'accepting': self.accepting(),
+            'webcam_sessions': self.webcam_sessions,
+            'max_webcam_sessions': self.max_webcam_sessions,
+            'inflight_uploads': self.inflight,
+            'max_inflight_uploads': self.max_inflight,
+            'utilization': max(
+                self.webcam_sessions / self.max_webcam_sessions if self.max_webcam_sessions else 1.0,
+                self.inflight / self.max_inflight if self.max_inflight else 1.0
+            ),
+            'rejected': dict(self.rejected)
+        }
+
+
+def client_key(scope, trusted_hops: int = None):
+    '''
+        Takes in ASGI scope and number of trusted proxies in front of the API (default TRUSTED_PROXY_HOPS, 0).
+        Returns client IP: the X-Forwarded-For entry appended by the outermost trusted proxy, or the peer address
+        with no trusted proxies. Entries further left are whatever the client sent, so they're never used.
+        Behind a proxy, per-client rate limits (CLIENT_RATE_PER_SEC) are only meaningful once hops are configured;
+        otherwise every user shares the proxy's address.
+    '''
+
+    if trusted_hops is None:
+        trusted_hops = _env_int('TRUSTED_PROXY_HOPS', 0)
+
+    if trusted_hops > 0:
+        forwarded = []
+        for name, value in scope.get('headers', []):
+            if name == b'x-forwarded-for':
+                forwarded.extend(entry.strip() for entry in value.decode('latin-1').split(','))
+        forwarded = [entry for entry in forwarded if entry]
+        if forwarded:
+            return forwarded[-min(trusted_hops, len(forwarded))]
+
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
+
+
+class AdmissionMiddleware:
+    '''
+        ASGI middleware admitting HTTP requests to the given paths before their bodies are read,
+        so rejected uploads cost nothing beyond the headers.
+    '''
+
+    def __init__(self, app, controller: AdmissionController, paths):
+        self.app = app
+        self.controller = controller
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            self.controller.admit_inflight(client_key(scope))
+        except Rejected as e:
+            await self._reject(send, e)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release_inflight()
+
+    async def _reject(self, send, rejection: Rejected):
+        body = json.dumps({'error': rejection.reason, 'retry_after': rejection.retry_after_header()}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': rejection.status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', rejection.retry_after_header().encode())
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,278 @@
+# batch_score.py
+'''
+    Offline batch scoring of outfit images. Streams images from a directory or tar file, runs detection + color
+    extraction in batches across a process pool and appends one JSON record per image to the output.
+    Re-running with the same output resumes where the previous run stopped.
+
+    python batch_score.py --input photos/ --output outfits.jsonl
+    python batch_score.py --input archive.tar.gz --output outfits_parquet/ --format parquet --llm
+'''
+
+import os
+import sys
+import json
+import time
+import tarfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+# Set in each worker process by init_worker()
+pipeline = None
+use_llm = False
+
+
+def init_worker(weights: str, llm: bool):
+    '''
+        Loads model once per worker process. Each worker is limited to one compute thread since the pool already
+        occupies every core and oversubscribing threads slows everything down.
+    '''
+
+    global pipeline, use_llm
+    os.environ['OMP_NUM_THREADS'] = '1'
+
+    import cv2
+    import torch
+    cv2.setNumThreads(1)
+    torch.set_num_threads(1)
+
+    import outfit_pipeline
+    outfit_pipeline.models.load('batch', weights)
+    pipeline = outfit_pipeline
+    use_llm = llm
+
+
+def score_batch(batch):
+    '''
+        Takes in list of (key, path or bytes) tuples and returns list of output records, one per image.
+        Images are decoded individually but run through the model as one batch.
+    '''
+
+    records = []
+    decoded = []
+    for key, source in batch:
+        try:
+            if isinstance(source, str):
+                with open(source, 'rb') as f:
+                    source = f.read()
+            decoded.append((key, *pipeline.decode_photo(source)))
+        except Exception as e:
+            records.append({'key': key, 'outfit': None, 'error': f'decode: {str(e)}'})
+
+    if not decoded:
+        return records
+
+    all_detections = pipeline.get_detections_batch([arr for _, arr, _ in decoded])
+    for (key, arr, scale), detections in zip(decoded, all_detections):
+        record = {'key': key, 'outfit': None, 'error': None}
+        try:
+            record['outfit'] = pipeline.get_outfit(detections, arr, scale)
+            if use_llm and record['outfit']:
+                recs = pipeline.get_gpt_response(record['outfit'])
+                record['recommendations'] = pipeline.enforce_word_limit(recs.choices[0].message.content, max_words=10)
+        except pipeline.MulOutfitsException:
+            record['error'] = 'multiple outfits'
+        except Exception as e:
+            record['error'] = str(e)
+        records.append(record)
+
+    return records
+
+
+def iter_directory(path: str):
+    '''
+        Yields (key, file path) for every image under directory. Keys are paths relative to the directory.
+        Only paths are yielded so workers read files themselves instead of shipping bytes between processes.
+    '''
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                full_path = os.path.join(root, name)
+                yield os.path.relpath(full_path, path), full_path
+
+
+def iter_tar(path: str, done: set):
+    '''
+        Yields (key, bytes) for every image in tar file (any compression), reading it as a stream.
+        Members already in `done` are skipped without reading their data.
+    '''
+
+    with tarfile.open(path, mode='r|*') as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTENSIONS): continue
+            if member.name in done: continue
+            f = tar.extractfile(member)
+            if f is not None:
+                yield member.name, f.read()
+
+
+def iter_batches(items, done: set, batch_size: int):
+    batch = []
+    for key, source in items:
+        if key in done: continue
+        batch.append((key, source))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class JsonlWriter:
+    '''
+        Appends records to JSONL file. Keys already in the file are treated as done so interrupted runs can resume.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def done_keys(self):
+        done = set()
+        if not os.path.exists(self.path): return done
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)['key'])
+                except (ValueError, KeyError):
+                    continue # Partially written last line from an interrupted run
+        return done
+
+    def __enter__(self):
+        self.file = open(self.path, 'a', encoding='utf-8')
+        return self
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+
+class ParquetWriter:
+    '''
+        Writes records as numbered Parquet part files in a directory. Outfits are stored as JSON strings.
+        Requires pyarrow.
+    '''
+
+    def __init__(self, path: str, rows_per_part: int = 10000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit('Parquet output requires pyarrow (pip install pyarrow)')
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self.pending = []
+        os.makedirs(path, exist_ok=True)
+
+    def _parts(self):
+        return sorted(name for name in os.listdir(self.path) if name.startswith('part-') and name.endswith('.parquet'))
+
+    def done_keys(self):
+        done = set()
+        for name in self._parts():
+            done.update(self.pq.read_table(os.path.join(self.path, name), columns=['key']).column('key').to_pylist())
+        return done
+
+    def __enter__(self):
+        return self
+
+    def write(self, records):
+        self.pending.extend(records)
+        if len(self.pending) >= self.rows_per_part:
+            self.flush()
+
+    def flush(self):
+        if not self.pending: return
+
+        table = self.pa.table({
+            'key': [r['key'] for r in self.pending],
+            'outfit': [json.dumps(r['outfit']) if r['outfit'] is not None else None for r in self.pending],
+            'error': [r['error'] for r in self.pending],
+            'recommendations': [r.get('recommendations') for r in self.pending]
+        })
+        name = f'part-{len(self._parts()):05d}.parquet'
+        tmp_path = os.path.join(self.path, f'.{name}.tmp')
+        self.pq.write_table(table, tmp_path)
+        os.replace(tmp_path, os.path.join(self.path, name)) # Only complete parts are ever visible to resume
+        self.pending = []
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def run(args):
+    writer = ParquetWriter(args.output) if args.format == 'parquet' else JsonlWriter(args.output)
+    done = writer.done_keys()
+    if done:
+        print(f"Resuming: {len(done)} images already scored")
+
+    if os.path.isdir(args.input):
+        items = iter_directory(args.input)
+    else:
+        items = iter_tar(args.input, done)
+    batches = iter_batches(items, done, args.batch)
+
+    processed = 0
+    errors = 0
+    start = time.monotonic()
+    last_report = start
+
+    if args.llm:
+        # OpenAI key usually lives in .env next to the API; loaded here so workers inherit it
+        from dotenv import load_dotenv
+        load_dotenv()
+
+    with writer, ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.weights, args.llm)) as pool:
+        # Bounded number of outstanding batches keeps memory flat while still keeping every worker busy
+        pending = set()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < args.workers * 2:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                pending.add(pool.submit(score_batch, batch))
+
+            if not pending: break
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                records = future.result()
+                writer.write(records)
+                processed += len(records)
+                errors += sum(1 for r in records if r['error'])
+
+            now = time.monotonic()
+            if now - last_report >= args.report_every:
+                print(f"{processed} images, {processed / (now - start):.1f} images/sec, {errors} errors")
+                last_report = now
+
+    elapsed = time.monotonic() - start
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"Completed! Scored {processed} images in {elapsed:.1f}s ({rate:.1f} images/sec), {errors} errors")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Batch score directory or tar file of outfit images')
+    parser.add_argument('--input', required=True, help='Directory of images or tar file (optionally compressed)')
+    parser.add_argument('--output', required=True, help='JSONL file, or directory when --format parquet')
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl', help='Output format')
+    parser.add_argument('--weights', default='best.pt', help='YOLO model weights')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--batch', type=int, default=16, help='Images per inference batch')
+    parser.add_argument('--llm', action='store_true', help='Also get recommendations from OpenAI for each outfit')
+    parser.add_argument('--report-every', type=float, default=10.0, help='Seconds between progress reports')
+
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,54 @@
+# catalog_keywords.py
+'''
+    Keyword maps used to normalize product titles, shared by the importer (to tag products) and title search
+    (so searching for a synonym finds products titled with another one).
+'''
+
+# Mappings for clothing types to normalized categories
+CLOTHING_TYPE_MAP = {
+    'shirt': ['shirt', 'button', 'oxford', 'dress shirt', 'formal shirt'],
+    't-shirt': ['t-shirt', 'tee', 'tshirt', 't shirt', 'graphic tee'],
+    'tank top': ['tank', 'sleeveless', 'camisole'],
+    'blouse': ['blouse', 'tunic', 'women\'s top'],
+    'sweatshirt': ['sweatshirt', 'hoodie', 'pullover'],
+    'jacket': ['jacket', 'coat', 'blazer', 'outerwear'],
+    'sweater': ['sweater', 'jumper', 'cardigan', 'knit'],
+    'pants': ['pants', 'trousers', 'slacks', 'chinos'],
+    'jeans': ['jeans', 'denim pants'],
+    'shorts': ['shorts', 'short pants'],
+    'skirt': ['skirt'],
+    'dress': ['dress', 'gown'],
+    'socks': ['socks', 'hosiery'],
+    'underwear': ['underwear', 'boxers', 'briefs', 'panties']
+}
+
+# Map normalized clothing types to model detection classes
+CLOTHING_CLASS_MAP = {
+    'shirt': 'long sleeve top',
+    't-shirt': 'short sleeve top',
+    'tank top': 'sleeveless top',
+    'blouse': 'long sleeve top',
+    'sweatshirt': 'long sleeve top',
+    'jacket': 'long sleeve outwear',
+    'sweater': 'long sleeve top',
+    'pants': 'trousers',
+    'jeans': 'trousers',
+    'shorts': 'shorts',
+    'skirt': 'skirt',
+    'dress': 'long sleeve dress'
+}
+
+# Common colors for normalization. Keys must match color_names.PALETTE so detected RGB colors map onto catalog colors
+COLOR_MAP = {
+    'black': ['black', 'noir'],
+    'white': ['white', 'ivory', 'cream', 'off-white'],
+    'gray': ['gray', 'grey', 'charcoal', 'heather', 'silver'],
+    'red': ['red', 'burgundy', 'maroon', 'crimson', 'scarlet'],
+    'blue': ['blue', 'navy', 'teal', 'turquoise', 'aqua', 'cobalt'],
+    'green': ['green', 'olive', 'lime', 'emerald', 'mint'],
+    'yellow': ['yellow', 'gold', 'mustard', 'lemon'],
+    'pink': ['pink', 'rose', 'magenta', 'fuchsia'],
+    'purple': ['purple', 'violet', 'lavender', 'plum', 'mauve'],
+    'orange': ['orange', 'coral', 'peach'],
+    'brown': ['brown', 'tan', 'khaki', 'beige', 'camel']
+}
@@ -0,0 +1,224 @@
+# catalog_snapshot.py
+'''
+    Columnar, memory-mapped snapshot of the product catalog written by import_amazon_products.py.
+    Workers open it with CatalogSnapshot(path) instantly and share one page-cached copy across processes.
+
+    path is a symlink to a versioned sibling directory (<path>.v<timestamp>). Every write goes to a new version which
+    is switched to atomically with os.replace on the symlink, so path always names a complete snapshot.
+
+    Directory layout:
+        meta.json                   version, row count, dictionaries for encoded columns
+        <numeric>.npy               price (float32), average_rating (float32), rating_count (int32)
+        <category>.codes.npy        dictionary codes (uint16) for product_type, color, gender, clothing_class
+        <string>.heap               UTF-8 bytes of every value concatenated, for title, brand, image_url, product_url
+        <string>.offsets.npy        (N + 1,) int64 start of each value in heap
+'''
+
+import os
+import json
+import time
+import shutil
+from array import array
+
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+
+NUMERIC_COLUMNS = {'price': ('f', np.float32), 'average_rating': ('f', np.float32), 'rating_count': ('i', np.int32)}
+CATEGORY_COLUMNS = ['product_type', 'color', 'gender', 'clothing_class']
+STRING_COLUMNS = ['title', 'brand', 'image_url', 'product_url']
+
+PRUNE_AFTER_SECONDS = 60 # Superseded versions are kept this long for readers that resolved them just before a switch
+
+
+def new_version(path: str):
+    '''
+        Takes in published path and returns new, empty versioned directory to write next version into.
+    '''
+
+    version_path = f'{os.path.normpath(path)}.v{time.time_ns()}'
+    os.makedirs(version_path)
+    return version_path
+
+
+def _versions(path: str):
+    directory, name = os.path.split(os.path.abspath(path))
+    prefix = f'{name}.v'
+    return sorted(
+        (int(entry[len(prefix):]), os.path.join(directory, entry))
+        for entry in os.listdir(directory) if entry.startswith(prefix) and entry[len(prefix):].isdigit()
+    )
+
+
+def publish(version_path: str, path: str, grace_seconds: float = PRUNE_AFTER_SECONDS):
+    '''
+        Takes in completely written versioned directory and published path and atomically points path at it.
+        Readers that resolved path earlier keep the version they resolved, so older versions are only removed once
+        their successor has been written for more than grace_seconds. Versions newer than the published one (still
+        being written) are never touched.
+    '''
+
+    path = os.path.normpath(path) # "catalog/" names the symlink itself, not something inside it
+    if os.path.isdir(path) and not os.path.islink(path):
+        # Plain directory written before versioning: moved aside once so path can become a symlink
+        os.rename(path, f'{path}.v0')
+
+    link_path = f'{path}.{os.getpid()}.link'
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.basename(version_path), link_path) # Relative, so the whole directory can be moved
+    os.replace(link_path, path)
+
+    current = os.path.realpath(path)
+    versions = [os.path.realpath(version) for _, version in _versions(path)]
+    published = versions.index(current) if current in versions else 0
+    now = time.time()
+    for old_path, successor in zip(versions[:published], versions[1:published + 1]):
+        if now - os.path.getmtime(successor) > grace_seconds:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+
+def resolve(path: str):
+    '''
+        Takes in published path and returns directory of version it currently points at. Readers resolve once and
+        open every file from the result, so all of them come from the same version.
+    '''
+
+    return os.path.realpath(path)
+
+
+class SnapshotWriter:
+    '''
+        Streams transformed products into a snapshot directory. Strings go straight to heap files and numbers into
+        compact typed arrays, so memory stays small even for millions of products. Written to a new version directory
+        and published on close so readers never see a partial snapshot.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.version_path = new_version(path)
+
+        self.count = 0
+        self.numeric = {name: array(typecode) for name, (typecode, _) in NUMERIC_COLUMNS.items()}
+        self.codes = {name: array('H') for name in CATEGORY_COLUMNS}
+        self.dictionaries = {name: {} for name in CATEGORY_COLUMNS}
+        self.heaps = {name: open(os.path.join(self.version_path, f'{name}.heap'), 'wb') for name in STRING_COLUMNS}
+        self.offsets = {name: array('q', [0]) for name in STRING_COLUMNS}
+
+    def add(self, product: dict):
+        '''
+            Appends product to every column. All values are converted before anything is appended, so a product that
+            fails conversion raises without leaving columns of different lengths behind.
+        '''
+
+        numeric = []
+        for name, (typecode, _) in NUMERIC_COLUMNS.items():
+            value = product.get(name) or 0
+            numeric.append(int(value) if typecode == 'i' else float(value))
+
+        categories = [str(product.get(name, '')) for name in CATEGORY_COLUMNS]
+        strings = [str(product.get(name, '')).encode('utf-8') for name in STRING_COLUMNS]
+
+        for name, value in zip(NUMERIC_COLUMNS, numeric):
+            self.numeric[name].append(value)
+
+        for name, value in zip(CATEGORY_COLUMNS, categories):
+            dictionary = self.dictionaries[name]
+            code = dictionary.get(value)
+            if code is None:
+                code = dictionary[value] = len(dictionary)
+            self.codes[name].append(code)
+
+        for name, encoded in zip(STRING_COLUMNS, strings):
+            self.heaps[name].write(encoded)
+            self.offsets[name].append(self.offsets[name][-1] + len(encoded))
+
+        self.count += 1
+
+    def close(self):
+        for name, (_, dtype) in NUMERIC_COLUMNS.items():
+            np.save(os.path.join(self.version_path, f'{name}.npy'), np.frombuffer(self.numeric[name], dtype=self.numeric[name].typecode).astype(dtype))
+
+        for name in CATEGORY_COLUMNS:
+            np.save(os.path.join(self.version_path, f'{name}.codes.npy'), np.frombuffer(self.codes[name], dtype=np.uint16))
+
+        for name in STRING_COLUMNS:
+            self.heaps[name].close()
+            np.save(os.path.join(self.version_path, f'{name}.offsets.npy'), np.frombuffer(self.offsets[name], dtype=np.int64))
+
+        with open(os.path.join(self.version_path, 'meta.json'), 'w') as f:
+            json.dump({
+                'version': SNAPSHOT_VERSION,
+                'count': self.count,
+                'dictionaries': {name: list(dictionary.keys()) for name, dictionary in self.dictionaries.items()}
+            }, f)
+
+        # Switching symlink so readers see either the old snapshot or the complete new one
+        publish(self.version_path, self.path)
+
+
+class CatalogSnapshot:
+    '''
+        Read-only view of a snapshot. Every column is memory-mapped, so opening is constant-time and no data is copied
+        until it's touched.
+    '''
+
+    def __init__(self, path: str):
+        path = resolve(path) # Every column comes from the same version even if a new one is published meanwhile
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if meta['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported catalog snapshot version {meta['version']}")
+
+        self.path = path
+        self.count = meta['count']
+        self.dictionaries = meta['dictionaries']
+        self.lookups = {name: {value: code for code, value in enumerate(values)} for name, values in self.dictionaries.items()}
+
+        self.numeric = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in NUMERIC_COLUMNS}
+        self.codes = {name: np.load(os.path.join(path, f'{name}.codes.npy'), mmap_mode='r') for name in CATEGORY_COLUMNS}
+        self.offsets = {name: np.load(os.path.join(path, f'{name}.offsets.npy'), mmap_mode='r') for name in STRING_COLUMNS}
+        self.heaps = {name: self._map_heap(name) for name in STRING_COLUMNS}
+
+    def _map_heap(self, name):
+        heap_path = os.path.join(self.path, f'{name}.heap')
+        if os.path.getsize(heap_path) == 0:
+            return np.empty(0, dtype=np.uint8) # Can't memory-map empty file
+        return np.memmap(heap_path, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name: str):
+        '''
+            Returns memory-mapped array for numeric column, or codes array for dictionary-encoded column.
+        '''
+
+        if name in self.numeric: return self.numeric[name]
+        return self.codes[name]
+
+    def mask(self, name: str, *values):
+        '''
+            Returns boolean array selecting rows whose dictionary-encoded column equals any of given values.
+        '''
+
+        codes = [self.lookups[name][v] for v in values if v in self.lookups[name]]
+        if not codes: return np.zeros(self.count, dtype=bool)
+        return np.isin(self.codes[name], codes)
+
+    def category(self, name: str, i: int):
+        return self.dictionaries[name][int(self.codes[name][i])]
+
+    def string(self, name: str, i: int):
+        start, end = self.offsets[name][i], self.offsets[name][i + 1]
+        return bytes(self.heaps[name][start:end]).decode('utf-8')
+
+    def record(self, i: int):
+        '''
+            Returns dict for row i shaped like the documents the importer inserts into MongoDB.
+        '''
+
+        product = {name: self.string(name, i) for name in STRING_COLUMNS}
+        product.update({name: self.category(name, i) for name in CATEGORY_COLUMNS})
+        product.update({name: self.numeric[name][i].item() for name in NUMERIC_COLUMNS})
+        return product
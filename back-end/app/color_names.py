@@ -0,0 +1,193 @@
+# color_names.py
+'''
+    Maps RGB values to the color names used by the product catalog (see COLOR_MAP in catalog_keywords.py).
+    A quantized RGB cube is precomputed once with the nearest palette name in CIELAB space, cached on disk,
+    and then queried with plain array indexing so naming costs the same for one pixel or a whole wardrobe.
+'''
+
+import os
+import re
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+
+# Reference swatches for every catalog color name. Several swatches per name let the
+# lookup follow the same synonyms the importer uses for titles (navy/teal -> blue, beige/khaki -> brown, ...)
+PALETTE = {
+    'black': [(0, 0, 0), (28, 28, 30)],
+    'white': [(255, 255, 255), (255, 255, 240), (255, 253, 208), (250, 249, 246)],
+    'gray': [(128, 128, 128), (54, 69, 79), (169, 169, 169), (192, 192, 192), (211, 211, 211)],
+    'red': [(255, 0, 0), (128, 0, 32), (128, 0, 0), (220, 20, 60), (255, 36, 0)],
+    'blue': [(0, 0, 255), (0, 0, 128), (0, 128, 128), (64, 224, 208), (0, 255, 255), (0, 71, 171), (70, 130, 180), (135, 206, 235)],
+    'green': [(0, 128, 0), (128, 128, 0), (50, 205, 50), (80, 200, 120), (152, 255, 152), (85, 107, 47)],
+    'yellow': [(255, 255, 0), (255, 215, 0), (225, 173, 1), (255, 247, 0)],
+    'pink': [(255, 192, 203), (255, 0, 127), (255, 0, 255), (255, 105, 180)],
+    'purple': [(128, 0, 128), (143, 0, 255), (230, 230, 250), (142, 69, 133), (224, 176, 255)],
+    'orange': [(255, 165, 0), (255, 127, 80), (255, 218, 185), (255, 140, 0)],
+    'brown': [(139, 69, 19), (210, 180, 140), (195, 176, 145), (245, 245, 220), (193, 154, 107), (101, 67, 33)]
+}
+
+COLOR_NAMES = list(PALETTE.keys())
+
+DEFAULT_BITS = 5 # 2^5 = 32 levels per channel -> 32^3 cube
+CACHE_DIR = os.getenv('COLOR_LUT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+
+RGB_PATTERN = re.compile(r'\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)')
+
+
+def rgb_to_lab(rgb):
+    '''
+        Takes in array of shape (..., 3) holding sRGB values in [0, 255] and returns array of the same shape holding CIELAB values (D65).
+    '''
+
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+
+    # Linear sRGB -> XYZ, normalized by the D65 white point
+    m = np.array([
+        [0.4124564 / 0.95047, 0.3575761 / 0.95047, 0.1804375 / 0.95047],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339 / 1.08883, 0.1191920 / 1.08883, 0.9503041 / 1.08883]
+    ])
+    xyz = linear @ m.T
+
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    L = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+    return np.stack([L, a, b], axis=-1)
+
+
+def _palette_arrays():
+    '''
+        Returns flattened swatch array (N, 3) and array mapping each swatch to its index in COLOR_NAMES.
+    '''
+
+    swatches = []
+    owners = []
+    for i, name in enumerate(COLOR_NAMES):
+        for swatch in PALETTE[name]:
+            swatches.append(swatch)
+            owners.append(i)
+
+    return np.array(swatches, dtype=np.float64), np.array(owners, dtype=np.uint8)
+
+
+def nearest_names(lab):
+    '''
+        Takes in array of shape (N, 3) holding CIELAB values and returns array of COLOR_NAMES indices of the nearest swatch.
+        Computed in chunks so building large tables doesn't allocate a full (N, swatches) distance matrix at once.
+    '''
+
+    swatches, owners = _palette_arrays()
+    swatches = rgb_to_lab(swatches)
+
+    result = np.empty(len(lab), dtype=np.uint8)
+    chunk = 65536
+    for start in range(0, len(lab), chunk):
+        block = lab[start:start + chunk]
+        dists = ((block[:, None, :] - swatches[None, :, :]) ** 2).sum(axis=2)
+        result[start:start + chunk] = owners[np.argmin(dists, axis=1)]
+
+    return result
+
+
+def build_lut(bits=DEFAULT_BITS):
+    '''
+        Builds (2^bits, 2^bits, 2^bits) uint8 array where entry [r, g, b] is the COLOR_NAMES index nearest to the center of that RGB bin.
+    '''
+
+    levels = 1 << bits
+    step = 256 / levels
+    centers = (np.arange(levels) + 0.5) * step
+    r, g, b = np.meshgrid(centers, centers, centers, indexing='ij')
+    cube = np.stack([r, g, b], axis=-1).reshape(-1, 3)
+
+    return nearest_names(rgb_to_lab(cube)).reshape(levels, levels, levels)
+
+
+def _lut_path(bits):
+    # Palette digest in filename so editing PALETTE invalidates old caches automatically
+    digest = hashlib.sha1(repr(sorted(PALETTE.items())).encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f'color_lut_{bits}_{digest}.npy')
+
+
+@lru_cache(maxsize=None)
+def get_lut(bits=DEFAULT_BITS):
+    '''
+        Returns lookup table for given bit depth, loading it from disk cache or building and saving it on first use.
+    '''
+
+    path = _lut_path(bits)
+    try:
+        lut = np.load(path)
+        if lut.shape == (1 << bits,) * 3:
+            return lut
+    except (OSError, ValueError):
+        pass
+
+    lut = build_lut(bits)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, lut)
+        os.replace(tmp_path, path) # Atomic so concurrent workers never read a half-written table
+    except OSError as e:
+        print(f"Could not cache color lookup table: {str(e)}")
+
+    return lut
+
+
+def name_indices(rgb, bits=DEFAULT_BITS):
+    '''
+        Takes in array of shape (..., 3) holding RGB values in [0, 255] and returns array of shape (...) holding COLOR_NAMES indices.
+    '''
+
+    rgb = np.clip(np.asarray(rgb), 0, 255).astype(np.uint8)
+    q = rgb >> (8 - bits)
+    return get_lut(bits)[q[..., 0], q[..., 1], q[..., 2]]
+
+
+def name_colors(rgb, bits=DEFAULT_BITS):
+    '''
+        Takes in array of shape (N, 3) holding RGB values and returns list of N color names.
+    '''
+
+    names = np.array(COLOR_NAMES)
+    return names[name_indices(rgb, bits)].tolist()
+
+
+def parse_rgb(color):
+    '''
+        Takes in string formatted like get_object_color's output, e.g. '(123, 45, 67)', and returns (r, g, b) tuple or None.
+    '''
+
+    match = RGB_PATTERN.search(color) if isinstance(color, str) else None
+    if match is None: return None
+    return tuple(int(v) for v in match.groups())
+
+
+def parse_rgb_array(colors):
+    '''
+        Takes in list of RGB strings and returns (N, 3) uint8 array and boolean mask of the strings that could be parsed.
+    '''
+
+    matches = [RGB_PATTERN.search(color) if isinstance(color, str) else None for color in colors]
+    valid = np.fromiter((m is not None for m in matches), dtype=bool, count=len(matches))
+    values = np.array([int(v) for m in matches if m is not None for v in m.groups()], dtype=np.int64).reshape(-1, 3)
+
+    arr = np.zeros((len(colors), 3), dtype=np.uint8)
+    arr[valid] = np.clip(values, 0, 255)
+    return arr, valid
+
+
+def color_name(color):
+    '''
+        Takes in RGB string or (r, g, b) tuple and returns nearest catalog color name, or 'unknown' if it can't be parsed.
+    '''
+
+    rgb = parse_rgb(color) if isinstance(color, str) else color
+    if rgb is None: return 'unknown'
+    return COLOR_NAMES[int(name_indices(rgb))]
@@ -0,0 +1,76 @@
+# frame_change.py
+'''
+    Cheap change detection for webcam frames. Each frame is reduced to a tiny grayscale thumbnail and compared with the
+    thumbnail of the last frame the detector actually ran on, so long runs of near-identical frames can reuse the
+    previous detections instead of running the model again.
+'''
+
+import os
+
+import cv2
+import numpy as np
+
+DIFF_THRESHOLD = float(os.getenv('FRAME_DIFF_THRESHOLD', '2.0')) # Mean absolute difference in gray levels (0-255)
+MAX_REUSE = int(os.getenv('FRAME_MAX_REUSE', '5')) # Consecutive frames that may reuse detections before forcing a run
+SIGNATURE_SIZE = (32, 24)
+
+
+def frame_signature(frame: np.ndarray):
+    '''
+        Takes in BGR frame and returns small grayscale thumbnail used to compare frames.
+        Area interpolation averages pixels, so sensor noise mostly cancels out.
+    '''
+
+    small = cv2.resize(frame, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+
+class ChangeDetector:
+    '''
+        Per-session decision whether frame differs enough from last detected frame to need a new detector run.
+        Compares against the last detected frame rather than the previous one so slow movement still adds up,
+        and caps consecutive reuses so detections are refreshed regularly even in a perfectly still scene.
+    '''
+
+    def __init__(self, threshold: float = DIFF_THRESHOLD, max_reuse: int = MAX_REUSE):
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.reference = None
+        self.detections = None
+        self.reused_in_row = 0
+        self.frames = 0
+        self.skipped = 0
+
+    def cached(self, signature: np.ndarray):
+        '''
+            Takes in frame signature and returns detections to reuse, or None if the detector has to run.
+        '''
+
+        self.frames += 1
+        if (
+            self.detections is None
+            or self.reused_in_row >= self.max_reuse
+            or self.reference.shape != signature.shape
+            or np.abs(signature - self.reference).mean() > self.threshold
+        ):
+            return None
+
+        self.reused_in_row += 1
+        self.skipped += 1
+        return self.detections
+
+    def update(self, signature: np.ndarray, detections):
+        '''
+            Records detections computed for frame with given signature.
+        '''
+
+        self.reference = signature
+        self.detections = detections
+        self.reused_in_row = 0
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'skip_ratio': round(self.skipped / self.frames, 3) if self.frames else 0.0
+        }
@@ -0,0 +1,203 @@
+# frame_protocol.py
+'''
+    Versioned binary envelope for frames on the /webcam/ websocket, plus per-session latency/drop statistics.
+
+    Every message is a fixed 36 byte big-endian header followed by the payload:
+
+        magic           2s   b'FD'
+        version         B    PROTOCOL_VERSION
+        payload type    B    PAYLOAD_JPEG / PAYLOAD_CONTROL
+        sequence        I    assigned by client, echoed back by server
+        capture ts      Q    client capture time in microseconds (client clock), echoed back
+        server recv ts  Q    microseconds since epoch when server received the frame (0 from client)
+        processed ts    Q    microseconds since epoch when server finished the frame (0 from client)
+        payload length  I
+
+    Control payloads are UTF-8 JSON objects with a "type" field. Bare JPEG messages without the envelope are still
+    accepted so older clients keep working; replies (frames and text such as recommendations) mirror whichever
+    format the client sent.
+'''
+
+import json
+import time
+import struct
+from collections import deque
+
+import numpy as np
+
+MAGIC = b'FD'
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct('!2sBBIQQQI')
+
+PAYLOAD_JPEG = 1
+PAYLOAD_CONTROL = 2
+
+
+class ProtocolError(Exception):
+    '''
+        Exception that is raised when a message has the envelope magic but can't be parsed.
+    '''
+    pass
+
+
+def now_us():
+    return time.time_ns() // 1000
+
+
+class Frame:
+    '''
+        Single message received on the websocket. `enveloped` is False for bare JPEG messages from legacy clients.
+    '''
+
+    __slots__ = ('payload_type', 'seq', 'capture_ts', 'recv_ts', 'payload', 'enveloped')
+
+    def __init__(self, payload_type, seq, capture_ts, recv_ts, payload, enveloped):
+        self.payload_type = payload_type
+        self.seq = seq
+        self.capture_ts = capture_ts
+        self.recv_ts = recv_ts
+        self.payload = payload
+        self.enveloped = enveloped
+
+    def json(self):
+        return json.loads(bytes(self.payload).decode('utf-8'))
+
+
+def decode_message(data: bytes, recv_ts: int = None):
+    '''
+        Takes in bytes received on websocket and returns Frame. Messages without the envelope magic are treated as bare JPEG.
+    '''
+
+    recv_ts = now_us() if recv_ts is None else recv_ts
+
+    if data[:2] != MAGIC:
+        return Frame(PAYLOAD_JPEG, None, None, recv_ts, data, False)
+
+    if len(data) < HEADER.size:
+        raise ProtocolError('Truncated header')
+
+    _, version, payload_type, seq, capture_ts, _, _, length = HEADER.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f'Unsupported protocol version {version}')
+    if len(data) - HEADER.size != length:
+        raise ProtocolError('Payload length mismatch')
+
+    payload = memoryview(data)[HEADER.size:]
+    return Frame(payload_type, seq, capture_ts, recv_ts, payload, True)
+
+
+def encode_message(payload_type: int, payload: bytes, seq: int = 0, capture_ts: int = 0, recv_ts: int = 0, processed_ts: int = 0):
+    '''
+        Takes in payload and header fields and returns enveloped message bytes.
+    '''
+
+    header = HEADER.pack(MAGIC, PROTOCOL_VERSION, payload_type, seq, capture_ts, recv_ts, processed_ts, len(payload))
+    return header + payload
+
+
+def encode_reply(request: Frame, payload_type: int, payload: bytes, processed_ts: int = None):
+    '''
+        Takes in Frame being answered and reply payload. Returns message in the same format the client used,
+        echoing sequence number and timestamps when enveloped.
+    '''
+
+    if not request.enveloped:
+        return payload
+
+    processed_ts = now_us() if processed_ts is None else processed_ts
+    return encode_message(payload_type, payload, request.seq, request.capture_ts, request.recv_ts, processed_ts)
+
+
+def encode_control(message: dict, request: Frame = None):
+    '''
+        Takes in dict and returns enveloped control message, echoing request's sequence number if given.
+    '''
+
+    payload = json.dumps(message).encode('utf-8')
+    if request is None:
+        return encode_message(PAYLOAD_CONTROL, payload, processed_ts=now_us())
+    return encode_message(PAYLOAD_CONTROL, payload, request.seq, request.capture_ts, request.recv_ts, now_us())
+
+
+def encode_text(request: Frame, kind: str, text: str):
+    '''
+        Takes in Frame being answered, message type and text. Returns text as-is for legacy clients, otherwise
+        control message {"type": kind, "text": text} echoing request's sequence number.
+    '''
+
+    if not request.enveloped:
+        return text
+    return encode_control({'type': kind, 'text': text}, request)
+
+
+def _percentiles(values):
+    if not values: return None
+    arr = np.fromiter(values, dtype=np.float64, count=len(values)) / 1000 # Microseconds to milliseconds
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2), 'max_ms': round(float(arr.max()), 2)}
+
+
+class FrameStats:
+    '''
+        Per-session frame accounting. Keeps bounded windows of recent latencies so memory doesn't grow with session length.
+    '''
+
+    def __init__(self, window: int = 512):
+        self.received = 0
+        self.processed = 0
+        self.dropped_queue_full = 0 # Dropped in receive() because inference fell behind
+        self.dropped_in_transit = 0 # Sequence gaps: sent by client but never arrived
+        self.out_of_order = 0
+        self.last_seq = None
+
+        self.server_latency = deque(maxlen=window) # Server receive -> processed
+        self.queue_wait = deque(maxlen=window) # Server receive -> inference started
+        self.glass_to_glass = deque(maxlen=window) # Client capture -> client display, reported in acks
+
+    def record_received(self, frame: Frame):
+        self.received += 1
+        if frame.seq is None: return
+
+        if self.last_seq is not None:
+            gap = frame.seq - self.last_seq - 1
+            if gap > 0:
+                self.dropped_in_transit += gap
+            elif gap < 0:
+                self.out_of_order += 1
+                return
+        self.last_seq = frame.seq
+
+    def record_dropped(self, frame: Frame):
+        self.dropped_queue_full += 1
+
+    def record_started(self, frame: Frame, started_ts: int):
+        self.queue_wait.append(started_ts - frame.recv_ts)
+
+    def record_processed(self, frame: Frame, processed_ts: int):
+        self.processed += 1
+        self.server_latency.append(processed_ts - frame.recv_ts)
+
+    def record_ack(self, ack: dict):
+        '''
+            Takes in ack control message {"type": "ack", "seq": ..., "capture_ts": ..., "display_ts": ...} sent by the client
+            once it displayed a returned frame. Both timestamps are client clock so no clock sync is needed.
+        '''
+
+        capture_ts, display_ts = ack.get('capture_ts'), ack.get('display_ts')
+        if isinstance(capture_ts, int) and isinstance(display_ts, int) and display_ts >= capture_ts:
+            self.glass_to_glass.append(display_ts - capture_ts)
+
+    def summary(self):
+        total = self.received + self.dropped_in_transit
+        dropped = self.dropped_queue_full + self.dropped_in_transit
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'dropped_queue_full': self.dropped_queue_full,
+            'dropped_in_transit': self.dropped_in_transit,
+            'out_of_order': self.out_of_order,
+            'drop_ratio': dropped / total if total else 0.0,
+            'queue_wait': _percentiles(self.queue_wait),
+            'server_latency': _percentiles(self.server_latency),
+            'glass_to_glass': _percentiles(self.glass_to_glass)
+        }
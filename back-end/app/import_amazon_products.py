@@ -1,71 +1,56 @@
 # import_amazon_products.py
+import io
+import os
+import bz2
+import gzip
+import lzma
 import json
 import re
+import time
 import pymongo
-from pymongo import MongoClient
+from pymongo import MongoClient, IndexModel
 import argparse
 from tqdm import tqdm
 
-# Connect to MongoDB
-client = MongoClient('mongodb://localhost:27017/')
-db = client['dressPro']  # Match the existing database case
-collection = db['products']
-
-# Create indexes for better performance
-collection.create_index([("product_type", 1)])
-collection.create_index([("color", 1)])
-collection.create_index([("gender", 1)])
-collection.create_index([("clothing_class", 1)])
-collection.create_index([("title", "text")])
-
-# Mappings for clothing types to normalized categories
-CLOTHING_TYPE_MAP = {
-    'shirt': ['shirt', 'button', 'oxford', 'dress shirt', 'formal shirt'],
-    't-shirt': ['t-shirt', 'tee', 'tshirt', 't shirt', 'graphic tee'],
-    'tank top': ['tank', 'sleeveless', 'camisole'],
-    'blouse': ['blouse', 'tunic', 'women\'s top'],
-    'sweatshirt': ['sweatshirt', 'hoodie', 'pullover'],
-    'jacket': ['jacket', 'coat', 'blazer', 'outerwear'],
-    'sweater': ['sweater', 'jumper', 'cardigan', 'knit'],
-    'pants': ['pants', 'trousers', 'slacks', 'chinos'],
-    'jeans': ['jeans', 'denim pants'],
-    'shorts': ['shorts', 'short pants'],
-    'skirt': ['skirt'],
-    'dress': ['dress', 'gown'],
-    'socks': ['socks', 'hosiery'],
-    'underwear': ['underwear', 'boxers', 'briefs', 'panties']
-}
-
-# Map normalized clothing types to model detection classes
-CLOTHING_CLASS_MAP = {
-    'shirt': 'long sleeve top',
-    't-shirt': 'short sleeve top',
-    'tank top': 'sleeveless top',
-    'blouse': 'long sleeve top',
-    'sweatshirt': 'long sleeve top',
-    'jacket': 'long sleeve outwear',
-    'sweater': 'long sleeve top',
-    'pants': 'trousers',
-    'jeans': 'trousers',
-    'shorts': 'shorts',
-    'skirt': 'skirt',
-    'dress': 'long sleeve dress'
-}
-
-# Common colors for normalization
-COLOR_MAP = {
-    'black': ['black', 'noir'],
-    'white': ['white', 'ivory', 'cream', 'off-white'],
-    'gray': ['gray', 'grey', 'charcoal', 'heather', 'silver'],
-    'red': ['red', 'burgundy', 'maroon', 'crimson', 'scarlet'],
-    'blue': ['blue', 'navy', 'teal', 'turquoise', 'aqua', 'cobalt'],
-    'green': ['green', 'olive', 'lime', 'emerald', 'mint'],
-    'yellow': ['yellow', 'gold', 'mustard', 'lemon'],
-    'pink': ['pink', 'rose', 'magenta', 'fuchsia'],
-    'purple': ['purple', 'violet', 'lavender', 'plum', 'mauve'],
-    'orange': ['orange', 'coral', 'peach'],
-    'brown': ['brown', 'tan', 'khaki', 'beige', 'camel']
-}
+from catalog_snapshot import SnapshotWriter
+from catalog_keywords import CLOTHING_TYPE_MAP, CLOTHING_CLASS_MAP, COLOR_MAP
+
+# Use faster JSON parser when installed, stdlib otherwise. Both accept bytes and raise json.JSONDecodeError
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Fashion records always contain this literal, so lines without it can be skipped before parsing
+FASHION_MARKER = b'AMAZON FASHION'
+
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
+DB_NAME = 'dressPro'  # Match the existing database case
+COLLECTION_NAME = 'products'
+STAGING_COLLECTION_NAME = 'products_staging'
+
+# Indexes for better performance
+INDEXES = [
+    [("product_type", 1)],
+    [("color", 1)],
+    [("gender", 1)],
+    [("clothing_class", 1)],
+    [("title", "text")]
+]
+
+client = None
+
+def get_collection(name=COLLECTION_NAME):
+    """Connect to MongoDB on first use and return collection, so importing this module has no side effects"""
+    global client
+    if client is None:
+        client = MongoClient(MONGO_URI)
+    return client[DB_NAME][name]
+
+def create_indexes(collection):
+    """Build all catalog indexes in a single command"""
+    collection.create_indexes([IndexModel(keys) for keys in INDEXES])
 
 def detect_product_type(title):
     """Detect product type from title"""
@@ -130,19 +115,56 @@ def get_price(price):
         return float(price)
     return 29.99  # Default price
 
-def process_file(filename, batch_size=100):
-    """Process Amazon dataset file and import to MongoDB"""
+def open_input(filename):
+    """Open dataset file as a byte stream, decompressing gzip/bz2/xz/zstd inputs on the fly"""
+    lower = filename.lower()
+    
+    if lower.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    if lower.endswith('.bz2'):
+        return bz2.open(filename, 'rb')
+    if lower.endswith(('.xz', '.lzma')):
+        return lzma.open(filename, 'rb')
+    if lower.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit("Reading .zst files requires zstandard (pip install zstandard)")
+        raw = open(filename, 'rb')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), buffer_size=1 << 20)
+    
+    return open(filename, 'rb', buffering=1 << 20)
+
+def process_file(filename, batch_size=100, snapshot=None, bulk=False):
+    """Process Amazon dataset file and import to MongoDB, optionally also writing a columnar catalog snapshot.
+    
+    In bulk mode products are loaded into an index-free staging collection, indexes are built once at the end
+    and staging is then renamed over the live collection, so readers never see a partial catalog."""
     products = []
     count = 0
     fashion_count = 0
+    snapshot_writer = SnapshotWriter(snapshot) if snapshot else None
+    timings = {}
+    
+    if bulk:
+        collection = get_collection(STAGING_COLLECTION_NAME)
+        collection.drop()  # Leftover from an interrupted bulk load
+    else:
+        collection = get_collection()
+        create_indexes(collection)
     
     print(f"Processing file: {filename}")
+    phase_start = time.perf_counter()
     
-    with open(filename, 'r', encoding='utf-8') as f:
+    with open_input(filename) as f:
         for line in tqdm(f):
+            # Cheap substring check skips most non-fashion records without parsing them
+            if FASHION_MARKER not in line:
+                continue
+            
             try:
                 # Parse JSON line
-                product = json.loads(line)
+                product = json_loads(line)
                 
                 # Filter non-fashion items
                 if 'main_category' not in product or product['main_category'] != "AMAZON FASHION":
@@ -180,16 +202,19 @@ def process_file(filename, batch_size=100):
                     'details': product.get('details', {})
                 }
                 
+                # Snapshot first: if the product can't be converted it's skipped everywhere, not only in the snapshot
+                if snapshot_writer:
+                    snapshot_writer.add(transformed_product)
                 products.append(transformed_product)
                 count += 1
                 
                 # Insert in batches
                 if len(products) >= batch_size:
-                    collection.insert_many(products)
+                    collection.insert_many(products, ordered=not bulk)
                     products = []
                     print(f"Inserted {count} products so far")
                 
-            except json.JSONDecodeError:
+            except json.JSONDecodeError: # orjson.JSONDecodeError subclasses it
                 continue
             except Exception as e:
                 print(f"Error processing line: {str(e)}")
@@ -197,14 +222,34 @@ def process_file(filename, batch_size=100):
     
     # Insert remaining products
     if products:
-        collection.insert_many(products)
+        collection.insert_many(products, ordered=not bulk)
+    timings['load'] = time.perf_counter() - phase_start
+
+    if snapshot_writer:
+        phase_start = time.perf_counter()
+        snapshot_writer.close()
+        timings['snapshot'] = time.perf_counter() - phase_start
+        print(f"Wrote catalog snapshot with {snapshot_writer.count} products to {snapshot}")
+    
+    if bulk:
+        phase_start = time.perf_counter()
+        create_indexes(collection)
+        timings['index'] = time.perf_counter() - phase_start
+        
+        # renameCollection with dropTarget replaces live collection atomically
+        phase_start = time.perf_counter()
+        collection.rename(COLLECTION_NAME, dropTarget=True)
+        timings['swap'] = time.perf_counter() - phase_start
     
     print(f"Completed! Found {fashion_count} fashion items, imported {count} products")
+    print("Timings: " + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in timings.items()))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Import Amazon fashion data to MongoDB')
-    parser.add_argument('--file', required=True, help='Amazon dataset JSON file')
+    parser.add_argument('--file', required=True, help='Amazon dataset JSONL file, optionally .gz/.bz2/.xz/.zst compressed')
     parser.add_argument('--batch', type=int, default=100, help='Batch size for insertion')
+    parser.add_argument('--snapshot', help='Also write memory-mappable columnar catalog snapshot to this directory')
+    parser.add_argument('--bulk', action='store_true', help='Full reload: load into staging collection, build indexes once, then swap into place')
     
     args = parser.parse_args()
-    process_file(args.file, args.batch)
\ No newline at end of file
+    process_file(args.file, args.batch, args.snapshot, args.bulk)
\ No newline at end of file
@@ -2,44 +2,81 @@ import os
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 import asyncio
-from io import BytesIO
+import json
+import hashlib
 from typing import List
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, File, UploadFile, Form
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, File, UploadFile, Form, Header, Body
 from fastapi.websockets import WebSocketState
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 import uvicorn
 
 import numpy as np
-from PIL import Image
 import cv2
-import scipy
-import scipy.cluster
 
-from ultralytics import YOLO
 import supervision as sv
 
-from openai import OpenAI
+from wardrobe import item_palette, style_profiles, bulk_profiles, ColorAccumulator
+from admission import AdmissionController, AdmissionMiddleware, Rejected, client_key, WS_TRY_AGAIN_LATER
+from singleflight import SingleFlight
+from frame_protocol import FrameStats, ProtocolError, decode_message, encode_reply, encode_control, encode_text, now_us, PAYLOAD_JPEG, PAYLOAD_CONTROL
+from visual_search import VisualIndex
+from sender import SessionSender
+from tracing import tracer, span, trace_request
+from uploads import BodyLimitMiddleware, UploadTooLarge, read_limited, MAX_REQUEST_BYTES
+from frame_change import ChangeDetector, frame_signature
+from sessions import SessionManager, Session
+from stages import Stage, STOP, stage_stats
+from catalog_snapshot import CatalogSnapshot
+from title_search import TitleIndex
+from roi import RoiTracker, detect_in_region
+from outfit_pipeline import (
+    models, llm_flight, clothing_groups, get_detections, get_isolated_object, get_gpt_response, enforce_word_limit, get_recs,
+    use_model_photo, decode_photo, MulOutfitsException
+)
 
 # Initializing app
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Loading model and using it on startup ensures app works efficiently
-    global model
-    model = YOLO("best.pt")
-    dummy_frame = np.zeros((640, 480, 3), dtype=np.uint8)
-    get_detections(dummy_frame)
+    # Loading model and using it on startup ensures app works efficiently (registry warms it before serving)
+    global visual_index, title_index
+    models.load(os.getenv('MODEL_VERSION', 'initial'), os.getenv('MODEL_PATH', 'best.pt'))
+
+    # Visual similarity index is optional and memory-mapped, so loading it is instant regardless of catalog size
+    visual_index = None
+    index_dir = os.getenv('VISUAL_INDEX_DIR')
+    if index_dir:
+        visual_index = VisualIndex(index_dir)
+        # Queries are embedded by a model of their own, pinned to the weights the index was built with, rather than
+        # by whichever detector version is serving
+        visual_index.load_embedding_model(os.getenv('VISUAL_EMBED_WEIGHTS'))
+
+    # Title search is likewise optional and memory-mapped; it reads records and filter columns from the catalog snapshot
+    title_index = None
+    snapshot_dir = os.getenv('CATALOG_SNAPSHOT_DIR')
+    title_index_dir = os.getenv('TITLE_INDEX_DIR')
+    if snapshot_dir and title_index_dir:
+        title_index = TitleIndex(title_index_dir, CatalogSnapshot(snapshot_dir))
     
     yield
-    del model
 
 app = FastAPI(lifespan=lifespan)
+
+# Admission control is added first so it sits inside CORS and rejections still carry CORS headers
+admission = AdmissionController.from_env()
+sessions = SessionManager.from_env()
+work_paths = ["/upload-photo", "/upload-multiple-photos", "/similar-items", "/bulk-wardrobe-profiles"]
+app.add_middleware(AdmissionMiddleware, controller=admission, paths=work_paths)
+app.add_middleware(BodyLimitMiddleware, max_bytes=MAX_REQUEST_BYTES, paths=work_paths)
+
 # Add this:
 from starlette.middleware.gzip import GZipMiddleware
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-print(f"API Key loaded: {OPENAI_API_KEY[:10]}...")  # Debug print
+print(f"API Key loaded: {(OPENAI_API_KEY or '')[:10]}...")  # Debug print
 
 origins = [
     "http://localhost:5173/",
@@ -56,385 +93,412 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-clothing_groups = {
-    "short sleeve top": "top", 
-    "long sleeve top": "top", 
-    "short sleeve outwear": "top", 
-    "long sleeve outwear": "top", 
-    "vest": "top",
-    "shorts": "bottom",
-    "trousers": "bottom",
-    "skirt": "bottom",
-    "short sleeve dress": "dress",
-    "long sleeve dress": "dress",
-    "vest dress": "dress",
-    "sling dress": "dress",
-    "sling": "other"
-}
+# Concurrent identical uploads (same image bytes) share one detection
+detection_flight = SingleFlight('detection')
 
 
-# Code for this function was written by Peter Hansen at https://stackoverflow.com/a/3244061 but slightly modified for my use case
-def get_object_color(frame: np.ndarray):
+def use_model_webcam(websocket: WebSocket, session: Session, sender: SessionSender, queue: asyncio.Queue, detections_dict: dict, colors: ColorAccumulator, stats: FrameStats, changes: ChangeDetector, roi: RoiTracker):
     '''
-        Takes in NumPy array representing image and returns string representing RGB value of most dominant color in image
+        Takes in WebSocket object, its session, its outbound sender, asyncio queue, dict to represent clothing detected when using webcam, per-class color
+        accumulator, session frame stats, change detector and region-of-interest tracker. Returns decode -> infer -> encode pipeline stages that make clothing predictions
+        on incoming frames from WebSocket and send back frames with labels/bounding boxes included. Stages run concurrently, so decoding the
+        next frame and encoding the previous one overlap with inference of the current one.
+        Frames that barely differ from the last detected one reuse its detections instead of running the model again, and once the user is
+        in position the model only looks at the region around recent detections. Colors of each class are accumulated as frames arrive so
+        they're ready once recommendations are needed.
+        After a single object is detected 300 times, gets outfit recommendations and sends them back to front end through WebSocket.
     '''
 
-    # Reading image
-    img = Image.fromarray(frame)
-    img = img.resize((150, 150)) # Resizing to reduce time
-    arr = np.asarray(img)
-    # Reshaping to 2D array where row represents pixel and col represents r/g/b value
-    arr = arr.reshape(arr.shape[0] * arr.shape[1], 3).astype(float) 
+    box_annotator = sv.BoundingBoxAnnotator(
+        thickness=2
+    )
+    label_annotator = sv.LabelAnnotator()
+
+    def decode(message):
+        # Decoding JPEG payload into NumPy array
+        arr = np.frombuffer(message.payload, dtype=np.uint8)
+        with span('decode'):
+            frame = cv2.imdecode(arr, 1)
+            signature = frame_signature(frame) if frame is not None else None
+        return frame, signature
+
+    async def decode_stage(message):
+        stats.record_started(message, now_us())
+        frame, signature = await asyncio.to_thread(decode, message)
+        if frame is None: return None # Not a decodable image, dropping it
+        return message, frame, signature
+
+    async def infer_stage(item):
+        message, frame, signature = item
+
+        detections = changes.cached(signature)
+        if detections is None:
+            region = roi.region()
+            detections = await asyncio.to_thread(detect_in_region, get_detections, frame, region)
+            roi.update(detections, frame.shape, region)
+            changes.update(signature, detections)
 
-    codes, _ = scipy.cluster.vq.kmeans(arr, 5) # Finding most dominant colors
-    vecs, _ = scipy.cluster.vq.vq(arr, codes) # Assigning each pixel to one of the dominant colors
-    counts, _ = np.histogram(vecs, len(codes)) # Counting occurrences
+        labels = []
+        with span('detection_loop'):
+            for bbox, _, confidence, _, _, class_dict in detections:
+                class_name = class_dict['class_name']
+                label = f'{class_name} {confidence:0.2f}'
+                labels.append(label)
+            
+                if class_name not in detections_dict:
+                    detections_dict[class_name] = {
+                        'conf': confidence,
+                        'detection count': 0
+                    }
+
+                elif confidence > detections_dict[class_name]['conf']:
+                    detections_dict[class_name]['conf'] = confidence
+
+                detections_dict[class_name]['detection count'] += 1
+                colors.add(class_name, frame, bbox, confidence)
+
+                # Once an object has been detected 300 times, assuming app has been given enough to time to get
+                # a good sense of what the user is wearing, so ending process and getting recommendations.
+                if detections_dict[class_name]['detection count'] >= 300:
+                    if str(websocket.application_state) == "WebSocketState.CONNECTED":
+                        sender.send_control(encode_text(message, 'status', "Detections completed."))
+
+                        recs = await asyncio.to_thread(get_recs, detections_dict, colors)
+                        recs = enforce_word_limit(recs, max_words=10)  # Add this line
+                        sender.send_control(encode_text(message, 'recommendations', recs))
+                        await sender.flush()
+
+                    return STOP
+
+        return message, frame, detections, labels
+
+    def annotate_and_encode(frame, detections, labels):
+        # Annotating detections
+        with span('annotate'):
+            frame = box_annotator.annotate(
+                scene=frame, 
+                detections=detections
+            )
+            frame = label_annotator.annotate(
+                scene=frame,
+                detections=detections,
+                labels=labels
+            )
 
-    index_max = np.argmax(counts) # Find most frequent
-    peak = codes[index_max] # Getting RGB value of most frequent
-    return f'({int(peak[0])}, {int(peak[1])}, {int(peak[2])})'
+        # Encoded annotated frame into bytes
+        with span('imencode'):
+            return cv2.imencode('.jpg', frame)[1].tobytes()
+
+    async def encode_stage(item):
+        message, frame, detections, labels = item
+        encoded_bytes = await asyncio.to_thread(annotate_and_encode, frame, detections, labels)
+        processed_ts = now_us()
+        stats.record_processed(message, processed_ts)
+
+        # Sending back to front end, echoing sequence number/timestamps if client sent them.
+        # Queued rather than awaited so a slow client only loses stale frames instead of stalling inference
+        sender.send_frame(encode_reply(message, PAYLOAD_JPEG, encoded_bytes, processed_ts))
+
+    # One slot between stages is enough for overlap; deeper buffers would only add latency
+    decoded = asyncio.Queue(maxsize=1)
+    inferred = asyncio.Queue(maxsize=1)
+    return [
+        Stage('decode', decode_stage, queue, decoded, session),
+        Stage('infer', infer_stage, decoded, inferred, session),
+        Stage('encode', encode_stage, inferred, session=session)
+    ]
 
 
-def get_detections(arr: np.ndarray):
+async def receive_frames(websocket: WebSocket, session: Session, sender: SessionSender, queue: asyncio.Queue, stats: FrameStats, report):
     '''
-        Takes in NumPy array representing image and returns Detections object encapsulating clothing detections. 
+        Receive loop for a webcam session, run as one of its tasks. Every message counts as session activity.
     '''
-    result = model(arr, agnostic_nms=True, verbose=False)[0]
-    detections = sv.Detections.from_ultralytics(result)
-    detections = detections[detections.confidence >= .4]
 
-    return detections
+    while True:
+        await receive(websocket, session, sender, queue, stats, report)
+        session.touch()
 
 
-def get_isolated_object(bbox, frame):
+async def receive(websocket: WebSocket, session: Session, sender: SessionSender, queue: asyncio.Queue, stats: FrameStats, report):
     '''
-        Takes in tuple representing bounding box of object and NumPy array representing full image.
-        Returns NumPy array representing image cropped to be just the object in bounding box.
+        Takes in WebSocket, its session, its outbound sender, asyncio queue, session frame stats and function returning other session stats
+        and putting incoming frames into queue.
+        Control messages are handled immediately instead of being queued behind frames.
     '''
 
-    x1, y1, x2, y2 = bbox
-    isolated_object = frame[int(y1):int(y2), int(x1):int(x2)]
+    data = await websocket.receive_bytes()
+    recv_ts = now_us()
 
-    return isolated_object
+    try:
+        message = decode_message(data, recv_ts)
+    except ProtocolError as e:
+        print(f"Dropping malformed webcam message: {str(e)}")
+        return
+
+    if message.payload_type == PAYLOAD_CONTROL:
+        handle_control(sender, message, stats, report)
+        return
+    if message.payload_type != PAYLOAD_JPEG:
+        print(f"Dropping webcam message with unknown payload type {message.payload_type}")
+        return
+
+    # Only frames are counted, so control messages don't use up sequence numbers in drop/ordering stats
+    stats.record_received(message)
+    try:
+        queue.put_nowait(message)
+        session.queued(message)
+    except asyncio.QueueFull:
+        stats.record_dropped(message)
 
 
-def get_openai_client():
-    api_key = os.getenv('OPENAI_API_KEY')
-    # For project keys, we need to set it directly
-    if api_key and api_key.startswith('sk-proj-'):
-        # Fix: Use api_key instead of project
-        return OpenAI(api_key=api_key)
-    else:
-        return OpenAI(api_key=api_key)
+def handle_control(sender: SessionSender, message, stats: FrameStats, report):
+    '''
+        Takes in outbound sender, control message, session frame stats and function returning other session stats.
+        Records display acks and answers stats requests.
+    '''
+
+    try:
+        control = message.json()
+    except ValueError:
+        return
+    if not isinstance(control, dict):
+        return # Valid JSON but not a control object, ignored like malformed JSON
+
+    if control.get('type') == 'ack':
+        stats.record_ack(control)
+    elif control.get('type') == 'stats':
+        sender.send_control(encode_control({'type': 'stats', **stats.summary(), **report()}, message))
 
+@app.get("/")
+async def root():
+    return {"message": "Welcome to the Outfit Detection API"}
 
-def get_gpt_response(outfit: list[dict]):
+
+@app.get("/load")
+async def load():
     '''
-        Takes in list representing clothing pieces in outfit and returns completion response from OpenAI's gpt-4o-mini LLM model
-        giving recommendations to improve outfit with ratings and structured feedback.
+        Reports current load for the load balancer. Responds with 503 once no new work can be admitted.
     '''
 
-    if len(outfit) == 0: return None
-
-    client = get_openai_client()
-    
-    system_prompt = 'You are a fashion stylist giving EXTREMELY brief outfit feedback. ' \
-                    'Follow this exact format:\n\n' \
-                    '- **Rating**: X/10 (just the number, no explanation)\n' \
-                    '- **Color Harmony**: Maximum 10 words\n' \
-                    '- **Layering Options**: Maximum 10 words\n' \
-                    '- **Accessories**: Maximum 10 words\n' \
-                    '- **Footwear**: Maximum 10 words\n\n' \
-                    'STRICT RULES:\n' \
-                    '- NEVER use more than 10 words per suggestion\n' \
-                    '- Use direct, minimal language\n' \
-                    '- Only mention specific colors and items\n' \
-                    '- Single sentence fragments only\n' \
-                    '- No explanations or justifications\n' \
-                    '- Count your words for each line\n' \
-                    '- If you exceed 10 words, cut words until under limit'
-
-
-    user_prompt = f"I am wearing {outfit[0]['class name']} in the color of RGB value {outfit[0]['color']}"
-    for i in range(1, len(outfit)):
-        user_prompt += f" and a {outfit[i]['class name']} in the color of RGB value {outfit[i]['color']}"
-    user_prompt += ". Give extremely brief, direct recommendations. Maximum 10 words per line."
-    
-    try:
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=200,  # Reducing max tokens since we want shorter responses
-            temperature=0.5  # Lower temperature for more predictable, concise responses
-        )
-        print("SUCCESS: OpenAI API call worked!")
-        return completion
-    except Exception as e:
-        print(f"ERROR WITH OPENAI: {str(e)}")
-        # Return mock response instead of failing
-        class MockCompletion:
-            class Choice:
-                class Message:
-                    content = "- **Rating**: 7/10\n- **Color Harmony**: Neutrals with dark contrast, good balance.\n- **Layering Options**: Light jacket or cardigan for warmth.\n- **Accessories**: Silver jewelry enhances the look.\n- **Footwear**: Black ankle boots would complement well."
-                message = Message()
-            choices = [Choice()]
-        return MockCompletion()
-
-
-def enforce_word_limit(text, max_words=10):
-    """Enforce word limit on each line of recommendations"""
-    lines = text.split('\n')
-    limited_lines = []
-    
-    for line in lines:
-        if '**Rating**' in line:
-            limited_lines.append(line)  # Don't modify rating line
-            continue
-            
-        parts = line.split('**: ')
-        if len(parts) != 2:
-            limited_lines.append(line)
-            continue
-            
-        title, content = parts
-        words = content.split()
-        if len(words) > max_words:
-            truncated = ' '.join(words[:max_words])
-            limited_lines.append(f"{title}**: {truncated}")
-        else:
-            limited_lines.append(line)
-            
-    return '\n'.join(limited_lines)
+    status = admission.load()
+    return JSONResponse(status, status_code=200 if status['accepting'] else 503)
 
-def get_recs(detections_dict):
+@app.get("/metrics")
+async def metrics():
     '''
-        Takes in dict representing all clothing detected and returns string representing recommendations from OpenAI's gpt-4o-mini LLM model
+        Reports runtime counters for monitoring.
     '''
 
-    objects_detected = [
-        (
-            class_name, 
-            detections_dict[class_name]['conf'], # Highest confidence level detected
-            detections_dict[class_name]['img'], # NumPy array representing frame where highest confidence level was detected
-            detections_dict[class_name]['detection count'] # Number of times object was detected
-        ) 
-        for class_name in detections_dict
-    ]
+    return {
+        "admission": admission.load(),
+        "models": models.stats(),
+        "sessions": sessions.stats(),
+        "coalescing": {
+            "detection": detection_flight.stats(),
+            "llm": llm_flight.stats()
+        }
+    }
 
-    objects_detected = sorted(
-        objects_detected, 
-        key=lambda o : o[3], # Sorting by number of frames objects were detected
-        reverse=True # Sorting from highest to lowest
-    )
 
-    outfit = []
-    detected_groups = {} # Will represent the clothing groups that were detected
-    for obj_name, _, img, _ in objects_detected:
-        group = clothing_groups[obj_name]
+@app.get("/admin/traces")
+async def export_traces(trace_id: str | None = None, x_admin_token: str | None = Header(None)):
+    '''
+        Exports buffered trace spans as Chrome trace JSON. Requires X-Admin-Token header matching ADMIN_TOKEN.
+    '''
+
+    if not is_admin(x_admin_token):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    return tracer.export(trace_id)
 
-        # Ensuring that > 1 item per clothing group isn't included in final outfit.
-        # This is necessary so that if model incorrectly predicts an object for only a few frames
-        # we won't consider it to be apart of the outfit.
-        if group not in detected_groups: 
-            if group == 'top' or group == 'bottom':
-                detected_groups['dress'] = True # Since user likely won't be wearing both a top/bottom and a dress
-            elif group == 'dress':
-                detected_groups['top'] = True 
-                detected_groups['bottom'] = True
-            detected_groups[group] = True
 
-            color = get_object_color(img)
-            outfit.append({'class name': obj_name, 'color': color})
+def is_admin(token: str | None):
+    '''
+        Takes in X-Admin-Token header value and returns whether it matches ADMIN_TOKEN (always False if unset).
+    '''
 
-    recs = get_gpt_response(outfit)
-    response_text = recs.choices[0].message.content
-    response_text = enforce_word_limit(response_text, max_words=10)
-    return response_text
+    admin_token = os.getenv('ADMIN_TOKEN')
+    return bool(admin_token) and token == admin_token
 
 
-async def use_model_webcam(websocket: WebSocket, queue: asyncio.Queue, detections_dict: dict):
+@app.get("/admin/models")
+async def model_status(x_admin_token: str | None = Header(None)):
     '''
-        Takes in WebSocket object, asyncio queue, and dict to represent clothing detected when using webcam.
-        Makes clothing predictions on incoming frames from WebSocket and sends back frames with labels/bounding boxes included.
-        After a single object is detected 300 times, gets outfit recommendations and sends them back to front end through WebSocket.
+        Reports loaded model versions with their state, pinned sessions/requests and latency.
     '''
 
-    socket_open = True
-    box_annotator = sv.BoundingBoxAnnotator(
-        thickness=2
-    )
-    label_annotator = sv.LabelAnnotator()
+    if not is_admin(x_admin_token):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
 
-    while True:
-        # Getting bytes representing frame from WebSocket and decoding them into NumPy array
-        bytes = await queue.get() 
-        arr = np.frombuffer(bytes, dtype=np.uint8)
-        frame = cv2.imdecode(arr, 1)
+    return models.stats()
 
-        detections = get_detections(frame)
 
-        labels = []
-        for bbox, _, confidence, _, _, class_dict in detections:
-            class_name = class_dict['class_name']
-            label = f'{class_name} {confidence:0.2f}'
-            labels.append(label)
-            
-            if class_name not in detections_dict:
-                isolated_object = get_isolated_object(bbox, frame)
-                detections_dict[class_name] = {
-                    'conf': confidence,
-                    'img': isolated_object,
-                    'detection count': 0
-                }
-
-            elif confidence > detections_dict[class_name]['conf']:
-                isolated_object = get_isolated_object(bbox, frame)
-                detections_dict[class_name]['conf'] = confidence
-                detections_dict[class_name]['img'] = isolated_object
-
-            detections_dict[class_name]['detection count'] += 1
-
-            # Once an object has been detected 300 times, assuming app has been given enough to time to get
-            # a good sense of what the user is wearing, so ending process and getting recommendations.
-            if detections_dict[class_name]['detection count'] >= 300:
-                if str(websocket.application_state) == "WebSocketState.CONNECTED":
-                    await websocket.send_text("Detections completed.")
-
-                    recs = get_recs(detections_dict)
-                    recs = enforce_word_limit(recs, max_words=10)  # Add this line
-                    await websocket.send_text(recs)
-
-                socket_open = False
-
-        if socket_open:
-            # Annotating detections
-            frame = box_annotator.annotate(
-                scene=frame, 
-                detections=detections
-            )
-            frame = label_annotator.annotate(
-                scene=frame,
-                detections=detections,
-                labels=labels
-            )
+# Event loop only keeps weak references to tasks, so background loads are held here until they finish
+model_loads = set()
 
-            # Encoded annotated frame into bytes and sending back to front end
-            encoded_bytes = cv2.imencode('.jpg', frame)[1].tobytes()
-            
-            await websocket.send_bytes(encoded_bytes)
-            
-        else : break
 
+def model_load_done(task: asyncio.Task):
+    model_loads.discard(task)
+    if task.cancelled():
+        print(f"Loading model version {task.get_name()} was cancelled")
+    elif task.exception() is not None:
+        print(f"Failed to load model version {task.get_name()}: {str(task.exception())}")
 
-async def receive(websocket: WebSocket, queue: asyncio.Queue):
+
+@app.post("/admin/models")
+async def load_model(
+    name: str = Body(...),
+    path: str = Body(...),
+    canary_percent: float = Body(0.0),
+    shadow_percent: float = Body(0.0),
+    x_admin_token: str | None = Header(None)
+):
     '''
-        Takes in WebSocket and asyncio queue and putting incoming frames into queue.
+        Loads and warms new model version in the background while current one keeps serving. Without canary_percent
+        or shadow_percent it replaces the active version once warm; otherwise it becomes the candidate until promoted/aborted.
     '''
 
-    bytes = await websocket.receive_bytes()
-    
-    try:
-        queue.put_nowait(bytes)
-    except asyncio.QueueFull:
-        pass
+    if not is_admin(x_admin_token):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    if name in models.versions or models.loading.get(name) == 'loading':
+        return JSONResponse({"error": f"Model version {name} already exists"}, status_code=409)
 
-@app.get("/")
-async def root():
-    return {"message": "Welcome to the Outfit Detection API"}
+    async def load_in_background():
+        await asyncio.to_thread(models.load, name, path, min(max(canary_percent, 0.0), 100.0), min(max(shadow_percent, 0.0), 100.0))
+        print(f"Model version {name} loaded from {path}")
 
-@app.websocket("/webcam/")
-async def use_camera_detection(websocket: WebSocket):
+    task = asyncio.create_task(load_in_background(), name=name)
+    model_loads.add(task)
+    task.add_done_callback(model_load_done)
+    return JSONResponse({"status": "loading", "name": name}, status_code=202)
+
+
+@app.post("/admin/models/{action}")
+async def change_candidate(action: str, x_admin_token: str | None = Header(None)):
     '''
-        Accepts websocket connection and creates asyncio task to use YOLO model with web camera.
-        Sends outfit recommendations.
+        Promotes candidate model version to active ("promote") or drops it ("abort").
     '''
 
-    await websocket.accept()
-    queue = asyncio.Queue(maxsize=10)
-    detections_dict = {}
-    detect_task = asyncio.create_task(use_model_webcam(websocket, queue, detections_dict))
-
-    # Common errors that occur that can be ignored
-    common_errs = [
-        "Unexpected ASGI message 'websocket.close', after sending 'websocket.close' or response already completed.",
-        'Cannot call "send" once a close message has been sent.',
-        'WebSocket is not connected. Need to call "accept" first.'
-    ]
+    if not is_admin(x_admin_token):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    if action not in ("promote", "abort"):
+        return JSONResponse({"error": f"Unknown action {action}"}, status_code=404)
 
     try:
-        while True:
-            await receive(websocket, queue)
-            
-    except WebSocketDisconnect:
-        detect_task.cancel()
-        try : await websocket.close()
+        models.promote() if action == "promote" else models.abort()
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
 
-        except RuntimeError as e:
-            if str(e) in common_errs : pass
-            else : print("In WebSocketDisconnect exception block:", e)
+    return models.stats()
 
-    except RuntimeError as e:
-        if str(e) in common_errs : pass
-        else : print("In RuntimeError exception block:", e)
-        
 
-class MulOutfitsException(Exception):
+@app.websocket("/webcam/")
+async def use_camera_detection(websocket: WebSocket):
     '''
-        Exception that is raised when multiple outfits are detected in single image.
+        Accepts websocket connection and creates asyncio task to use YOLO model with web camera.
+        Sends outfit recommendations. Session ends when client disconnects, recommendations have been sent, or
+        idle/maximum duration timeout is reached.
     '''
-    pass
 
+    await websocket.accept()
+    try:
+        admission.admit_webcam(client_key(websocket.scope))
+    except Rejected as e:
+        # Close code 1013 (Try Again Later) with retry hint in reason so client can back off
+        await websocket.close(code=WS_TRY_AGAIN_LATER, reason=f"{e.reason}; retry-after={e.retry_after_header()}")
+        return
+
+    # Everything after admission is inside try so the session slot (and model pin) is given back even if setup fails
+    model_version = None
+    report = None
+    try:
+        # Session keeps the model version it started with even if a new one is activated meanwhile
+        model_version = models.acquire()
+        stats = FrameStats()
+        changes = ChangeDetector()
+        roi = RoiTracker()
+        sender = SessionSender(websocket)
+        stages = []
+
+        def report():
+            return {'egress': sender.stats(), 'reuse': changes.stats(), 'roi': roi.stats(), 'stages': stage_stats(stages)}
+
+        # Common errors that occur that can be ignored
+        common_errs = [
+            "Unexpected ASGI message 'websocket.close', after sending 'websocket.close' or response already completed.",
+            'Cannot call "send" once a close message has been sent.',
+            'WebSocket is not connected. Need to call "accept" first.'
+        ]
+
+        # Session owns every task and buffer below and cancels/clears them however the session ends
+        async with sessions.open(websocket) as session:
+            queue = session.track('queue', asyncio.Queue(maxsize=10))
+            detections_dict = session.track('detections', {})
+            colors = ColorAccumulator()
+            session.track('colors', colors.counts)
+            session.track('color sums', colors.sums)
+            session.track('outbound frames', sender.frames)
+            session.track('outbound control', sender.control)
+
+            stages.extend(use_model_webcam(websocket, session, sender, queue, detections_dict, colors, stats, changes, roi))
+            for stage in stages[1:]:
+                session.track(f'{stage.name} inbox', stage.inbox)
+
+            # Tasks copy current context when created, so everything they do is recorded under the session trace
+            # and uses the pinned model version
+            with tracer.trace('webcam session'), models.pinned(model_version):
+                session.spawn(sender.run(), 'send')
+                for stage in stages:
+                    session.spawn(stage.run(), stage.name)
+                session.spawn(receive_frames(websocket, session, sender, queue, stats, report), 'receive')
 
-def use_model_photo(image_bytes: bytes):
-    '''
-        Takes in bytes representing image and returns dict representing outfit detected in image.
-    '''
+            try:
+                reason = await session.run()
+                if reason in ('idle timeout', 'max duration reached'):
+                    print(f"Closing webcam session {session.id}: {reason}")
 
-    img = Image.open(BytesIO(image_bytes))
-    arr = np.asarray(img)
+            except WebSocketDisconnect:
+                pass
 
-    detections = get_detections(arr)
+            except RuntimeError as e:
+                if str(e) in common_errs : pass
+                else : print("In RuntimeError exception block:", e)
 
-    outfit = []
-    detected_groups = {}
-    for bbox, _, _, _, _, class_dict in detections:
-        obj_name = class_dict['class_name']
-        group = clothing_groups[obj_name]
-        
-        # Ensuring that > 1 item per clothing group isn't included in final outfit.
-        # This is necessary because if model predicts > 1 item in same clothing group, there is likely > 1 people wearing
-        # outfits in image and thus app can't give accurate recommendations. 
-        if group not in detected_groups:
-            if group == 'top' or group == 'bottom': # Since user likely won't be wearing both a top/bottom and a dress
-                detected_groups['dress'] = True
+            except Exception as e:
+                print(f"Webcam session {session.id} failed: {str(e)}")
 
-            elif group == 'dress':
-                detected_groups['top'] = True
-                detected_groups['bottom'] = True
+    finally:
+        if model_version is not None:
+            models.release(model_version)
+        admission.release_webcam()
+        if report is not None and stats.received > 0:
+            print(f"Webcam session stats: {stats.summary()}, {report()}")
 
-            detected_groups[group] = True
 
-            isolated_object = get_isolated_object(bbox, arr)
-            color = get_object_color(isolated_object)
-        
-            outfit.append({'class name': obj_name, 'color': color})
+async def detect_outfit(image_bytes: bytes):
+    '''
+        Takes in bytes representing image and returns outfit detected in it, running detection in a worker thread.
+        Concurrent requests with identical image bytes share a single detection.
+    '''
 
-        else : raise MulOutfitsException()
+    with models.use() as version:
+        # Version in key so requests routed to a canary never share results with the active version
+        key = (version.name, hashlib.blake2b(image_bytes, digest_size=16).digest())
+        outfit = await detection_flight.do_async(key, use_model_photo, image_bytes)
 
-    return outfit
+    # Copying items since callers annotate them and the list may be shared with coalesced requests
+    return [dict(item) for item in outfit]
 
 
 @app.post("/upload-photo/")
-async def use_photo_detection(file: bytes=File(...)):
+@trace_request('upload-photo')
+async def use_photo_detection(file: UploadFile=File(...)):
     try:
-        outfit = use_model_photo(file)
+        outfit = await detect_outfit(await read_limited(file))
         if not outfit or len(outfit) == 0:
             return {"text": "- **No outfit detected**: Ensure photo has clothing in it."}
             
-        recs = get_gpt_response(outfit)
+        recs = await asyncio.to_thread(get_gpt_response, outfit)
         text = recs.choices[0].message.content
         # Apply word limit to ensure concise recommendations
         text = enforce_word_limit(text, max_words=10)
@@ -442,6 +506,8 @@ async def use_photo_detection(file: bytes=File(...)):
         
     except MulOutfitsException:
         text = "- **Multiple outfits detected**: Photo can only contain one outfit in it to ensure accurate results."
+    except UploadTooLarge as e:
+        text = f"- **Photo too large**: {str(e)}."
     except Exception as e:
         print(f"Unexpected error processing image: {str(e)}")
         text = f"- **Error processing image**: {str(e)}"
@@ -450,7 +516,105 @@ async def use_photo_detection(file: bytes=File(...)):
         return {"text": text}
 
 
+def find_similar_items(image_bytes: bytes, k: int):
+    '''
+        Takes in bytes representing image and number of results wanted. Returns list with similar catalog products
+        for each clothing item detected in image.
+    '''
+
+    arr, _ = decode_photo(image_bytes)
+    detections = get_detections(arr)
+
+    # Degenerate or sub-pixel boxes give empty crops, which can't be described
+    crops = [get_isolated_object(bbox, arr) for bbox in detections.xyxy]
+    detections = detections[np.array([crop.size > 0 for crop in crops], dtype=bool)]
+    crops = [crop for crop in crops if crop.size > 0]
+    if len(detections) == 0: return []
+
+    descriptors = visual_index.describe(crops)
+
+    return [
+        {
+            'class name': class_name,
+            'similar': [{'id': product_id, 'score': round(score, 4)} for product_id, score in visual_index.search(descriptor, k)]
+        }
+        for class_name, descriptor in zip(detections.data['class_name'], descriptors)
+    ]
+
+
+@app.post("/similar-items/")
+@trace_request('similar-items')
+async def similar_items(file: UploadFile=File(...), k: int=Form(10)):
+    '''
+        Finds catalog products that look like each clothing item in uploaded photo.
+    '''
+
+    if visual_index is None:
+        return {"error": "Visual search is not configured"}
+
+    try:
+        image_bytes = await read_limited(file)
+        with models.use():
+            items = await asyncio.to_thread(find_similar_items, image_bytes, min(k, 100))
+    except Exception as e:
+        print(f"Unexpected error in similar-items: {str(e)}")
+        return {"error": f"Failed to search similar items: {str(e)}"}
+
+    return {"items": items}
+
+
+@app.get("/search/")
+async def search_products(
+    q: str,
+    k: int = 20,
+    gender: str | None = None,
+    color: str | None = None,
+    clothing_class: str | None = None,
+    prefix: bool = True
+):
+    '''
+        Ranked search over catalog product titles, optionally filtered by gender, color and clothing class.
+        Last word of query also matches as a prefix so results can be shown while typing.
+    '''
+
+    if title_index is None:
+        return {"error": "Title search is not configured"}
+
+    products = title_index.records(q, max(1, min(k, 100)), prefix, gender=gender, color=color, clothing_class=clothing_class)
+    return {"products": products}
+
+
+class WardrobeItem(BaseModel):
+    class_name: str = Field('', alias='class name')
+    color: str | None = None # "(r, g, b)"; anything unparseable is left out of color profile
+
+
+class WardrobeUser(BaseModel):
+    user_id: int | str | None = None
+    items: List[WardrobeItem] = []
+
+
+@app.post("/bulk-wardrobe-profiles/")
+async def bulk_wardrobe_profiles(users: List[WardrobeUser] = Body(..., embed=True)):
+    '''
+        Computes style and color profiles for many users in one call from their precomputed detected items:
+        {"users": [{"user_id": ..., "items": [{"class name": ..., "color": "(r, g, b)"}, ...]}, ...]}
+        Streams back one JSON profile per line as each chunk of users is finished.
+        Body is validated before streaming starts, so malformed input gets a 422 instead of a truncated 200.
+    '''
+
+    def generate():
+        for start in range(0, len(users), 1000):
+            chunk = [user.model_dump(by_alias=True) for user in users[start:start + 1000]]
+            for profile in bulk_profiles(chunk):
+                yield json.dumps(profile) + '\n'
+
+    # Sync generator is iterated in threadpool so aggregation doesn't block the event loop
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
 @app.post("/upload-multiple-photos/")
+@trace_request('upload-multiple-photos')
 async def analyze_multiple_photos(files: List[UploadFile] = File(...), gender: str = Form(...)):
     """
     Analyze multiple outfit photos and provide style recommendations based on them
@@ -461,10 +625,9 @@ async def analyze_multiple_photos(files: List[UploadFile] = File(...), gender: s
         
         # Process each uploaded file
         for file in files:
-            contents = await file.read()
-            
             try:
-                outfit = use_model_photo(contents)
+                contents = await read_limited(file)
+                outfit = await detect_outfit(contents)
                 
                 if outfit and len(outfit) > 0:
                     for item in outfit:
@@ -507,79 +670,19 @@ async def analyze_multiple_photos(files: List[UploadFile] = File(...), gender: s
 # Helper functions for the multi-photo analysis
 def analyze_dominant_colors(items):
     """Extract and analyze the dominant colors from all detected items"""
-    # This is a simplified version - in a real app you would do more sophisticated color analysis
-    all_colors = {}
-    
-    for item in items:
-        color = item['color']
-        if color in all_colors:
-            all_colors[color] += 1
-        else:
-            all_colors[color] = 1
-    
-    # Convert to list of [color, count] and sort by count
-    color_list = [[color, count] for color, count in all_colors.items()]
-    color_list.sort(key=lambda x: x[1], reverse=True)
-    
-    # Calculate percentages
-    total = sum(count for _, count in color_list)
-    color_list = [[color, round((count / total) * 100)] for color, count in color_list]
-    
-    return color_list[:5]  # Return top 5 colors
+    # Clustering in CIELAB merges near-identical shades (e.g. two navy items) into one dominant color
+    palette = item_palette(items, k=5)
+
+    # Convert to list of [color, percentage], already sorted by weight
+    return [[entry['color'], round(entry['share'] * 100)] for entry in palette]
 
 def determine_style_types(items, gender):
     """Determine style types based on detected clothing items and colors"""
-    # In a real app, this would be a complex algorithm
-    # This is a simplified mock implementation
-    
-    # Count item types
-    tops = sum(1 for item in items if item['group'] == 'top')
-    bottoms = sum(1 for item in items if item['group'] == 'bottom')
-    dresses = sum(1 for item in items if item['group'] == 'dress')
-    
-    # Mock style determination
-    styles = {
-        "Casual": 0,
-        "Formal": 0,
-        "Classic": 0,
-        "Trendy": 0,
-        "Minimalist": 0,
-        "Bohemian": 0
-    }
-    
-    # Basic style determination - this would be much more sophisticated in reality
-    for item in items:
-        class_name = item['class name'].lower()
-        
-        if 'outwear' in class_name:
-            styles["Casual"] += 10
-            
-        if 'sleeve top' in class_name:
-            styles["Classic"] += 15
-            
-        if 'dress' in class_name:
-            styles["Formal"] += 20
-            
-        if 'trousers' in class_name:
-            styles["Classic"] += 10
-            styles["Minimalist"] += 5
-            
-        if 'shorts' in class_name:
-            styles["Casual"] += 15
-            
-        if 'skirt' in class_name:
-            styles["Trendy"] += 10
-            styles["Bohemian"] += 5
-    
-    # Convert to list and calculate percentages
-    style_list = [[style, score] for style, score in styles.items() if score > 0]
-    style_list.sort(key=lambda x: x[1], reverse=True)
-    
-    total = sum(score for _, score in style_list)
-    if total > 0:
-        style_list = [[style, round((score / total) * 100)] for style, score in style_list]
-    
-    return style_list[:3]  # Return top 3 styles
+    # Style points per clothing class come from wardrobe.STYLE_RULES, shared with the bulk profile API
+    if not items: return []
+
+    user_index = np.zeros(len(items), dtype=np.int64)
+    return style_profiles(user_index, [item['class name'] for item in items], 1, top=3)[0]
 
 def generate_recommendations(items, colors, styles, gender):
     """Generate product recommendations based on style analysis"""
@@ -0,0 +1,267 @@
+# model_registry.py
+'''
+    Versioned model registry allowing new weights to be loaded and warmed in the background while the current
+    version keeps serving, then switched over atomically. Requests and webcam sessions pin the version they started
+    with, so old versions are only released once everything using them has drained. A candidate version can also
+    take a percentage of new traffic (canary) or have a percentage of calls mirrored to it without serving them (shadow).
+'''
+
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+_pinned = contextvars.ContextVar('model_version', default=None)
+
+
+def _copy_input(value):
+    # Shadow runs after the caller has moved on, and callers annotate frames in place, so it gets its own copy
+    if isinstance(value, np.ndarray): return value.copy()
+    if isinstance(value, (list, tuple)): return type(value)(_copy_input(v) for v in value)
+    return value
+
+
+class ModelVersion:
+    '''
+        Single loaded model plus its serving state and latency stats. The model isn't safe to call from several
+        threads at once, so every call goes through this version's lock.
+    '''
+
+    def __init__(self, name: str, path: str, model):
+        self.name = name
+        self.path = path
+        self.model = model
+        self.lock = threading.Lock()
+        self.state = 'warming'
+        self.refs = 0 # Requests/sessions currently pinned to this version, guarded by registry lock
+        self.calls = 0
+        self.latencies = deque(maxlen=1024)
+
+    def predict(self, *args, **kwargs):
+        with self.lock:
+            start = time.perf_counter()
+            result = self.model(*args, **kwargs)
+            self.latencies.append(time.perf_counter() - start)
+            self.calls += 1
+        return result
+
+    def warm(self):
+        # Running model once up front so first real request doesn't pay for lazy initialization
+        self.predict(np.zeros((640, 480, 3), dtype=np.uint8), verbose=False)
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'path': self.path,
+            'state': self.state,
+            'pinned': self.refs,
+            'calls': self.calls,
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+            'p95_ms': round(float(np.percentile(latencies, 95)), 2) if len(latencies) else None
+        }
+
+
+class ModelRegistry:
+    '''
+        Holds active version and optional candidate. All state changes happen under one lock, so switching the
+        active version is atomic for new requests while pinned ones finish on whatever version they started with.
+    '''
+
+    def __init__(self, loader):
+        self.loader = loader # Callable taking weights path and returning model
+        self.lock = threading.Lock()
+        self.versions = {}
+        self.active = None
+        self.candidate = None
+        self.canary_percent = 0.0
+        self.shadow_percent = 0.0
+        self.loading = {} # Name -> 'loading' or error message for background loads
+        self.shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+        self.shadow_busy = False # Guarded by lock
+        self.shadow_mirrored = 0
+        self.shadow_skipped = 0
+
+    def load(self, name: str, path: str, canary_percent: float = 0.0, shadow_percent: float = 0.0):
+        '''
+            Loads and warms model from path as version `name`. Blocking, so run it in a worker thread when serving.
+            With canary_percent (share of new requests/sessions it serves) or shadow_percent (share of model calls
+            mirrored to it) the version becomes the candidate, otherwise it replaces the active version.
+            Shadow takes precedence if both are given.
+        '''
+
+        with self.lock:
+            if name in self.versions or self.loading.get(name) == 'loading':
+                raise ValueError(f'Model version {name} is already loaded')
+            self.loading[name] = 'loading'
+
+        try:
+            version = ModelVersion(name, path, self.loader(path))
+            version.warm()
+        except Exception as e:
+            with self.lock:
+                self.loading[name] = f'failed: {str(e)}'
+            raise
+
+        with self.lock:
+            del self.loading[name]
+            self.versions[name] = version
+
+            if (canary_percent > 0 or shadow_percent > 0) and self.active is not None:
+                if self.candidate is not None:
+                    self._drain(self.candidate)
+                self.candidate = version
+                self.canary_percent = 0.0 if shadow_percent > 0 else canary_percent
+                self.shadow_percent = shadow_percent
+                version.state = 'shadow' if shadow_percent > 0 else 'canary'
+            else:
+                self._promote(version)
+
+        return version
+
+    def promote(self):
+        '''
+            Makes candidate the active version.
+        '''
+
+        with self.lock:
+            if self.candidate is None:
+                raise ValueError('No candidate model to promote')
+            self._promote(self.candidate)
+
+    def abort(self):
+        '''
+            Drops candidate without promoting it.
+        '''
+
+        with self.lock:
+            if self.candidate is None:
+                raise ValueError('No candidate model to abort')
+            self._drain(self.candidate)
+            self._clear_candidate()
+
+    def _promote(self, version: ModelVersion):
+        old = self.active
+        self.active = version
+        version.state = 'active'
+        if self.candidate is version:
+            self._clear_candidate()
+        if old is not None:
+            self._drain(old)
+
+    def _clear_candidate(self):
+        self.candidate = None
+        self.canary_percent = 0.0
+        self.shadow_percent = 0.0
+
+    def _drain(self, version: ModelVersion):
+        version.state = 'draining'
+        self._maybe_retire(version)
+
+    def _maybe_retire(self, version: ModelVersion):
+        # Dropping registry's reference only; any caller still holding the version keeps the model alive until done
+        if version.state == 'draining' and version.refs == 0:
+            version.state = 'retired'
+            self.versions.pop(version.name, None)
+
+    def acquire(self):
+        '''
+            Picks version for a new request or session (candidate for canary share of traffic, active otherwise)
+            and pins it until release() is called.
+        '''
+
+        with self.lock:
+            version = self.active
+            if self.candidate is not None and random.random() * 100 < self.canary_percent:
+                version = self.candidate
+            version.refs += 1
+            return version
+
+    def release(self, version: ModelVersion):
+        with self.lock:
+            version.refs -= 1
+            self._maybe_retire(version)
+
+    @contextmanager
+    def pinned(self, version: ModelVersion):
+        '''
+            Makes version current for code inside block (and any tasks or threads started from it).
+        '''
+
+        token = _pinned.set(version)
+        try:
+            yield version
+        finally:
+            _pinned.reset(token)
+
+    @contextmanager
+    def use(self):
+        '''
+            Acquires, pins and releases a version around a single request.
+        '''
+
+        version = self.acquire()
+        try:
+            with self.pinned(version):
+                yield version
+        finally:
+            self.release(version)
+
+    def current(self):
+        '''
+            Returns version pinned by the current request/session, or active version if nothing is pinned.
+        '''
+
+        version = _pinned.get()
+        return version if version is not None else self.active
+
+    def predict(self, *args, **kwargs):
+        '''
+            Runs current version. When a shadow candidate is set, shadow_percent of calls are mirrored to it in the
+            background (on a copy of the input) for latency comparison; mirrors are skipped while the previous one is
+            still running so they never queue up.
+        '''
+
+        version = self.current()
+        result = version.predict(*args, **kwargs)
+
+        with self.lock:
+            shadow = self.candidate if self.shadow_percent > 0 else None
+            mirror = shadow is not None and shadow is not version and random.random() * 100 < self.shadow_percent
+            if mirror and self.shadow_busy:
+                self.shadow_skipped += 1
+                mirror = False
+            elif mirror:
+                self.shadow_busy = True
+                self.shadow_mirrored += 1
+
+        if mirror:
+            self.shadow_executor.submit(self._run_shadow, shadow, _copy_input(args), kwargs)
+
+        return result
+
+    def _run_shadow(self, version: ModelVersion, args, kwargs):
+        try:
+            version.predict(*args, **kwargs)
+        except Exception as e:
+            print(f"Shadow model {version.name} failed: {str(e)}")
+        finally:
+            with self.lock:
+                self.shadow_busy = False
+
+    def stats(self):
+        with self.lock:
+            return {
+                'active': self.active.name if self.active else None,
+                'candidate': self.candidate.name if self.candidate else None,
+                'canary_percent': self.canary_percent,
+                'shadow_percent': self.shadow_percent,
+                'shadow_mirrored': self.shadow_mirrored,
+                'shadow_skipped': self.shadow_skipped,
+                'loading': dict(self.loading),
+                'versions': {name: version.stats() for name, version in self.versions.items()}
+            }
@@ -0,0 +1,326 @@
+# outfit_pipeline.py
+'''
+    Detection and recommendation pipeline shared by the API (main.py) and offline batch scoring (batch_score.py):
+    YOLO detection, per-item color extraction, outfit assembly and LLM recommendations.
+    Importing it has no side effects beyond creating the (empty) model registry, so worker processes can use it
+    without building the web app.
+'''
+
+import os
+
+import numpy as np
+from PIL import Image
+import scipy
+import scipy.cluster
+
+from ultralytics import YOLO
+import supervision as sv
+
+from openai import OpenAI
+
+from color_names import color_name
+from wardrobe import ColorAccumulator
+from singleflight import SingleFlight
+from tracing import traced
+from uploads import decode_downscaled, scale_box
+from model_registry import ModelRegistry
+
+clothing_groups = {
+    "short sleeve top": "top", 
+    "long sleeve top": "top", 
+    "short sleeve outwear": "top", 
+    "long sleeve outwear": "top", 
+    "vest": "top",
+    "shorts": "bottom",
+    "trousers": "bottom",
+    "skirt": "bottom",
+    "short sleeve dress": "dress",
+    "long sleeve dress": "dress",
+    "vest dress": "dress",
+    "sling dress": "dress",
+    "sling": "other"
+}
+
+# Concurrent identical prompts share one API call
+llm_flight = SingleFlight('llm')
+
+# Versions of the YOLO model currently serving; new weights can be swapped in without restarting (see /admin/models)
+models = ModelRegistry(YOLO)
+
+
+# Code for this function was written by Peter Hansen at https://stackoverflow.com/a/3244061 but slightly modified for my use case
+@traced('get_object_color')
+def get_object_color(frame: np.ndarray):
+    '''
+        Takes in NumPy array representing image and returns string representing RGB value of most dominant color in image
+    '''
+
+    # Reading image
+    img = Image.fromarray(frame)
+    img = img.resize((150, 150)) # Resizing to reduce time
+    arr = np.asarray(img)
+    # Reshaping to 2D array where row represents pixel and col represents r/g/b value
+    arr = arr.reshape(arr.shape[0] * arr.shape[1], 3).astype(float) 
+
+    codes, _ = scipy.cluster.vq.kmeans(arr, 5) # Finding most dominant colors
+    vecs, _ = scipy.cluster.vq.vq(arr, codes) # Assigning each pixel to one of the dominant colors
+    counts, _ = np.histogram(vecs, len(codes)) # Counting occurrences
+
+    index_max = np.argmax(counts) # Find most frequent
+    peak = codes[index_max] # Getting RGB value of most frequent
+    return f'({int(peak[0])}, {int(peak[1])}, {int(peak[2])})'
+
+
+@traced('get_detections')
+def get_detections(arr: np.ndarray, imgsz: int | None = None):
+    '''
+        Takes in NumPy array representing image and optional model input size (default is model's own) and returns Detections
+        object encapsulating clothing detections. 
+    '''
+    options = {'imgsz': imgsz} if imgsz else {}
+    result = models.predict(arr, agnostic_nms=True, verbose=False, **options)[0]
+    detections = sv.Detections.from_ultralytics(result)
+    detections = detections[detections.confidence >= .4]
+
+    return detections
+
+
+@traced('get_detections_batch')
+def get_detections_batch(arrs: list[np.ndarray]):
+    '''
+        Takes in list of NumPy arrays representing images and returns list of Detections objects, running model on them as one batch.
+    '''
+    results = models.predict(arrs, agnostic_nms=True, verbose=False)
+
+    batch = []
+    for result in results:
+        detections = sv.Detections.from_ultralytics(result)
+        batch.append(detections[detections.confidence >= .4])
+
+    return batch
+
+
+def get_isolated_object(bbox, frame):
+    '''
+        Takes in tuple representing bounding box of object and NumPy array representing full image.
+        Returns NumPy array representing image cropped to be just the object in bounding box.
+    '''
+
+    x1, y1, x2, y2 = bbox
+    isolated_object = frame[int(y1):int(y2), int(x1):int(x2)]
+
+    return isolated_object
+
+
+def get_openai_client():
+    api_key = os.getenv('OPENAI_API_KEY')
+    # For project keys, we need to set it directly
+    if api_key and api_key.startswith('sk-proj-'):
+        # Fix: Use api_key instead of project
+        return OpenAI(api_key=api_key)
+    else:
+        return OpenAI(api_key=api_key)
+
+
+@traced('get_gpt_response')
+def get_gpt_response(outfit: list[dict]):
+    '''
+        Takes in list representing clothing pieces in outfit and returns completion response from OpenAI's gpt-4o-mini LLM model
+        giving recommendations to improve outfit with ratings and structured feedback.
+    '''
+
+    if len(outfit) == 0: return None
+
+    client = get_openai_client()
+    
+    system_prompt = 'You are a fashion stylist giving EXTREMELY brief outfit feedback. ' \
+                    'Follow this exact format:\n\n' \
+                    '- **Rating**: X/10 (just the number, no explanation)\n' \
+                    '- **Color Harmony**: Maximum 10 words\n' \
+                    '- **Layering Options**: Maximum 10 words\n' \
+                    '- **Accessories**: Maximum 10 words\n' \
+                    '- **Footwear**: Maximum 10 words\n\n' \
+                    'STRICT RULES:\n' \
+                    '- NEVER use more than 10 words per suggestion\n' \
+                    '- Use direct, minimal language\n' \
+                    '- Only mention specific colors and items\n' \
+                    '- Single sentence fragments only\n' \
+                    '- No explanations or justifications\n' \
+                    '- Count your words for each line\n' \
+                    '- If you exceed 10 words, cut words until under limit'
+
+
+    user_prompt = f"I am wearing {outfit[0]['class name']} in the color of RGB value {outfit[0]['color']}"
+    for i in range(1, len(outfit)):
+        user_prompt += f" and a {outfit[i]['class name']} in the color of RGB value {outfit[i]['color']}"
+    user_prompt += ". Give extremely brief, direct recommendations. Maximum 10 words per line."
+
+    # Keyed on exact prompt so identical outfits requested at the same time make a single API call
+    return llm_flight.do((system_prompt, user_prompt), request_completion, client, system_prompt, user_prompt)
+
+
+def request_completion(client: OpenAI, system_prompt: str, user_prompt: str):
+    '''
+        Takes in OpenAI client and prompts and returns completion response, or mock response if API call fails.
+    '''
+
+    try:
+        completion = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            max_tokens=200,  # Reducing max tokens since we want shorter responses
+            temperature=0.5  # Lower temperature for more predictable, concise responses
+        )
+        print("SUCCESS: OpenAI API call worked!")
+        return completion
+    except Exception as e:
+        print(f"ERROR WITH OPENAI: {str(e)}")
+        # Return mock response instead of failing
+        class MockCompletion:
+            class Choice:
+                class Message:
+                    content = "- **Rating**: 7/10\n- **Color Harmony**: Neutrals with dark contrast, good balance.\n- **Layering Options**: Light jacket or cardigan for warmth.\n- **Accessories**: Silver jewelry enhances the look.\n- **Footwear**: Black ankle boots would complement well."
+                message = Message()
+            choices = [Choice()]
+        return MockCompletion()
+
+
+@traced('enforce_word_limit')
+def enforce_word_limit(text, max_words=10):
+    """Enforce word limit on each line of recommendations"""
+    lines = text.split('\n')
+    limited_lines = []
+    
+    for line in lines:
+        if '**Rating**' in line:
+            limited_lines.append(line)  # Don't modify rating line
+            continue
+            
+        parts = line.split('**: ')
+        if len(parts) != 2:
+            limited_lines.append(line)
+            continue
+            
+        title, content = parts
+        words = content.split()
+        if len(words) > max_words:
+            truncated = ' '.join(words[:max_words])
+            limited_lines.append(f"{title}**: {truncated}")
+        else:
+            limited_lines.append(line)
+            
+    return '\n'.join(limited_lines)
+
+@traced('get_recs')
+def get_recs(detections_dict, colors: ColorAccumulator):
+    '''
+        Takes in dict representing all clothing detected and colors accumulated for each class over the session.
+        Returns string representing recommendations from OpenAI's gpt-4o-mini LLM model
+    '''
+
+    objects_detected = [
+        (
+            class_name, 
+            detections_dict[class_name]['conf'], # Highest confidence level detected
+            detections_dict[class_name]['detection count'] # Number of times object was detected
+        ) 
+        for class_name in detections_dict
+    ]
+
+    objects_detected = sorted(
+        objects_detected, 
+        key=lambda o : o[2], # Sorting by number of frames objects were detected
+        reverse=True # Sorting from highest to lowest
+    )
+
+    outfit = []
+    detected_groups = {} # Will represent the clothing groups that were detected
+    for obj_name, _, _ in objects_detected:
+        group = clothing_groups[obj_name]
+
+        # Ensuring that > 1 item per clothing group isn't included in final outfit.
+        # This is necessary so that if model incorrectly predicts an object for only a few frames
+        # we won't consider it to be apart of the outfit.
+        if group not in detected_groups: 
+            if group == 'top' or group == 'bottom':
+                detected_groups['dress'] = True # Since user likely won't be wearing both a top/bottom and a dress
+            elif group == 'dress':
+                detected_groups['top'] = True 
+                detected_groups['bottom'] = True
+            detected_groups[group] = True
+
+            color = colors.color(obj_name)
+            outfit.append({'class name': obj_name, 'color': color, 'color name': color_name(color)})
+
+    recs = get_gpt_response(outfit)
+    response_text = recs.choices[0].message.content
+    response_text = enforce_word_limit(response_text, max_words=10)
+    return response_text
+
+
+class MulOutfitsException(Exception):
+    '''
+        Exception that is raised when multiple outfits are detected in single image.
+    '''
+    pass
+
+
+def use_model_photo(image_bytes: bytes):
+    '''
+        Takes in bytes representing image and returns dict representing outfit detected in image.
+    '''
+
+    arr, scale = decode_photo(image_bytes)
+    detections = get_detections(arr)
+
+    return get_outfit(detections, arr, scale)
+
+
+@traced('decode_photo')
+def decode_photo(image_bytes: bytes):
+    '''
+        Takes in bytes representing image and returns NumPy array representing image, downscaled during decoding to
+        what detection needs, and factor to multiply its coordinates by to get original image coordinates.
+    '''
+
+    return decode_downscaled(image_bytes)
+
+
+@traced('get_outfit')
+def get_outfit(detections, arr: np.ndarray, scale: float = 1.0):
+    '''
+        Takes in Detections object, NumPy array representing image they were detected in and factor mapping array coordinates
+        to original image coordinates. Returns list representing outfit.
+        Raises MulOutfitsException if image appears to contain more than one outfit.
+    '''
+
+    outfit = []
+    detected_groups = {}
+    for bbox, _, _, _, _, class_dict in detections:
+        obj_name = class_dict['class_name']
+        group = clothing_groups[obj_name]
+        
+        # Ensuring that > 1 item per clothing group isn't included in final outfit.
+        # This is necessary because if model predicts > 1 item in same clothing group, there is likely > 1 people wearing
+        # outfits in image and thus app can't give accurate recommendations. 
+        if group not in detected_groups:
+            if group == 'top' or group == 'bottom': # Since user likely won't be wearing both a top/bottom and a dress
+                detected_groups['dress'] = True
+
+            elif group == 'dress':
+                detected_groups['top'] = True
+                detected_groups['bottom'] = True
+
+            detected_groups[group] = True
+
+            isolated_object = get_isolated_object(bbox, arr)
+            color = get_object_color(isolated_object)
+        
+            outfit.append({'class name': obj_name, 'color': color, 'color name': color_name(color), 'box': scale_box(bbox, scale)})
+
+        else : raise MulOutfitsException()
+
+    return outfit
@@ -0,0 +1,124 @@
+# roi.py
+'''
+    Region-of-interest cropping for webcam detection. Once the user is in position their clothing stays in roughly
+    the same part of the frame, so the detector is run on a padded crop around recent detections at a proportionally
+    smaller input size (same pixels per object, fewer pixels overall) and boxes are mapped back to frame coordinates.
+    Full frames are still checked periodically, and whenever the crop looks wrong, so new or moved items are found.
+'''
+
+import os
+from collections import deque
+
+import numpy as np
+
+ROI_ENABLED = os.getenv('WEBCAM_ROI', '1') == '1'
+REVALIDATE_EVERY = int(os.getenv('ROI_REVALIDATE_EVERY', '15')) # Detector runs between full-frame passes
+PADDING = float(os.getenv('ROI_PADDING', '0.15')) # Fraction of region width/height added on every side
+HISTORY = int(os.getenv('ROI_HISTORY', '5')) # Detector runs whose boxes make up the region
+MAX_AREA = float(os.getenv('ROI_MAX_AREA', '0.6')) # Larger regions aren't worth cropping
+MIN_INPUT_SIZE = 320
+STRIDE = 32 # Model input sizes must be multiples of its stride
+
+
+def input_size(region_side: int, frame_side: int, full_size: int = 640):
+    '''
+        Takes in longest side of region and frame and model input size used for full frames. Returns input size giving
+        region the same scale full frames get, rounded up to model stride.
+    '''
+
+    size = int(np.ceil(full_size * region_side / frame_side / STRIDE)) * STRIDE
+    return min(full_size, max(MIN_INPUT_SIZE, size))
+
+
+class RoiTracker:
+    '''
+        Per-session region of interest built from union of garment boxes over the last few detector runs.
+    '''
+
+    def __init__(self, enabled: bool = ROI_ENABLED, revalidate_every: int = REVALIDATE_EVERY, padding: float = PADDING,
+                 history: int = HISTORY, max_area: float = MAX_AREA):
+        self.enabled = enabled
+        self.revalidate_every = revalidate_every
+        self.padding = padding
+        self.max_area = max_area
+        self.boxes = deque(maxlen=history)
+        self.region_box = None
+        self.since_full = 0
+        self.full_runs = 0
+        self.roi_runs = 0
+        self.roi_area = 0.0
+
+    def region(self):
+        '''
+            Returns (x1, y1, x2, y2) integer region to run detector on next, or None for full frame.
+        '''
+
+        if not self.enabled or self.region_box is None or self.since_full >= self.revalidate_every:
+            return None
+        return self.region_box
+
+    def update(self, detections, frame_shape, region):
+        '''
+            Takes in detections in frame coordinates, frame shape and region they were detected in (None for full frame)
+            and updates region for next frames.
+        '''
+
+        height, width = frame_shape[:2]
+        if region is None:
+            self.full_runs += 1
+            self.since_full = 0
+        else:
+            self.roi_runs += 1
+            self.since_full += 1
+            self.roi_area += (region[2] - region[0]) * (region[3] - region[1]) / (width * height)
+
+        if len(detections) == 0 or (region is not None and self._touches_edge(detections.xyxy, region, width, height)):
+            # Nothing found in region, or an item may continue past it: next run looks at full frame again
+            self.boxes.clear()
+            self.region_box = None
+            return
+
+        self.boxes.append(detections.xyxy.min(axis=0)[:2].tolist() + detections.xyxy.max(axis=0)[2:].tolist())
+        x1, y1 = np.min([b[:2] for b in self.boxes], axis=0)
+        x2, y2 = np.max([b[2:] for b in self.boxes], axis=0)
+        pad_x, pad_y = (x2 - x1) * self.padding, (y2 - y1) * self.padding
+        box = (max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y)), min(width, int(np.ceil(x2 + pad_x))), min(height, int(np.ceil(y2 + pad_y))))
+
+        area = (box[2] - box[0]) * (box[3] - box[1]) / (width * height)
+        self.region_box = box if area <= self.max_area else None
+
+    @staticmethod
+    def _touches_edge(xyxy, region, width, height, margin=2):
+        x1, y1, x2, y2 = region
+        return bool(
+            (x1 > 0 and (xyxy[:, 0] <= x1 + margin).any())
+            or (y1 > 0 and (xyxy[:, 1] <= y1 + margin).any())
+            or (x2 < width and (xyxy[:, 2] >= x2 - margin).any())
+            or (y2 < height and (xyxy[:, 3] >= y2 - margin).any())
+        )
+
+    def stats(self):
+        runs = self.full_runs + self.roi_runs
+        return {
+            'full_runs': self.full_runs,
+            'roi_runs': self.roi_runs,
+            'roi_ratio': round(self.roi_runs / runs, 3) if runs else 0.0,
+            'avg_roi_area': round(self.roi_area / self.roi_runs, 3) if self.roi_runs else None
+        }
+
+
+def detect_in_region(detect, frame: np.ndarray, region):
+    '''
+        Takes in detect(arr, imgsz=None) function returning sv.Detections, frame and region from RoiTracker.region().
+        Runs detector on region (or whole frame if None) and returns detections in frame coordinates.
+    '''
+
+    if region is None:
+        return detect(frame)
+
+    x1, y1, x2, y2 = region
+    crop = np.ascontiguousarray(frame[y1:y2, x1:x2])
+    detections = detect(crop, imgsz=input_size(max(crop.shape[:2]), max(frame.shape[:2])))
+    if len(detections):
+        detections.xyxy = detections.xyxy + np.array([x1, y1, x1, y1], dtype=detections.xyxy.dtype)
+    return detections
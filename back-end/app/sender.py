@@ -0,0 +1,122 @@
+# sender.py
+'''
+    Per-session outbound queue for the /webcam/ websocket. Sending happens on its own task so a slow client never
+    blocks inference; annotated frames are superseded by newer ones while control messages are always delivered.
+'''
+
+import time
+import asyncio
+from collections import deque
+
+from fastapi import WebSocket
+
+from tracing import span
+
+
+class SessionSender:
+    '''
+        Owns all sends for one websocket. Frames go into a small bounded buffer where the oldest frame is dropped
+        when a newer one arrives; control messages (text, recommendations, stats) go into an unbounded queue that
+        is drained first and never dropped.
+    '''
+
+    def __init__(self, websocket: WebSocket, max_frames: int = 1, stall_seconds: float = 0.1):
+        self.websocket = websocket
+        self.frames = deque(maxlen=max_frames)
+        self.control = deque()
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.stall_seconds = stall_seconds
+
+        self.started = time.monotonic()
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.control_sent = 0
+        self.bytes_sent = 0
+        self.send_seconds = 0.0
+        self.stalls = 0
+        self.max_send_seconds = 0.0
+
+    def send_frame(self, data: bytes):
+        '''
+            Queues annotated frame, replacing oldest queued frame if buffer is full. Never blocks.
+        '''
+
+        if len(self.frames) == self.frames.maxlen:
+            self.frames_dropped += 1
+        self.frames.append(data)
+        self._wake()
+
+    def send_control(self, data):
+        '''
+            Queues control message (str sent as text, bytes as binary). Control messages are never dropped.
+        '''
+
+        self.control.append(data)
+        self._wake()
+
+    def _wake(self):
+        self.idle.clear()
+        self.wakeup.set()
+
+    async def flush(self):
+        '''
+            Waits until everything queued so far has been sent.
+        '''
+
+        await self.idle.wait()
+
+    async def run(self):
+        '''
+            Sender loop, run as its own task for the lifetime of the session.
+        '''
+
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+
+                while self.control or self.frames:
+                    if self.control:
+                        data = self.control.popleft()
+                        is_frame = False
+                    else:
+                        data = self.frames.popleft()
+                        is_frame = True
+
+                    start = time.monotonic()
+                    with span('send'):
+                        if isinstance(data, str):
+                            await self.websocket.send_text(data)
+                        else:
+                            await self.websocket.send_bytes(data)
+                    elapsed = time.monotonic() - start
+
+                    self.bytes_sent += len(data)
+                    self.send_seconds += elapsed
+                    self.max_send_seconds = max(self.max_send_seconds, elapsed)
+                    if elapsed > self.stall_seconds:
+                        self.stalls += 1
+                    if is_frame:
+                        self.frames_sent += 1
+                    else:
+                        self.control_sent += 1
+
+                self.idle.set()
+        finally:
+            # Waking anyone blocked in flush() if sending failed (e.g. client disconnected)
+            self.idle.set()
+
+    def stats(self):
+        duration = time.monotonic() - self.started
+        return {
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'control_sent': self.control_sent,
+            'bytes_sent': self.bytes_sent,
+            'egress_bytes_per_sec': round(self.bytes_sent / duration) if duration > 0 else 0,
+            'send_busy_ratio': round(self.send_seconds / duration, 3) if duration > 0 else 0.0,
+            'send_stalls': self.stalls,
+            'max_send_ms': round(self.max_send_seconds * 1000, 2)
+        }
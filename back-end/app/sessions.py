@@ -0,0 +1,189 @@
+# sessions.py
+'''
+    Lifecycle management for /webcam/ sessions. Each session owns its tasks and buffers; whichever way the session
+    ends (client disconnect, error, recommendations sent, idle or maximum duration reached) every task is cancelled
+    and awaited, buffers are cleared and the socket is closed. Live task counts and buffered bytes per session are
+    exposed for monitoring.
+'''
+
+import os
+import time
+import asyncio
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+
+import numpy as np
+from fastapi import WebSocket
+from fastapi.websockets import WebSocketState
+
+SESSION_IDLE_SECONDS = float(os.getenv('SESSION_IDLE_SECONDS', '30'))
+SESSION_MAX_SECONDS = float(os.getenv('SESSION_MAX_SECONDS', '900'))
+
+
+def buffer_bytes(obj, depth: int = 0):
+    '''
+        Takes in buffer (deque, dict, list, array, bytes or frame) or queued item and returns approximate bytes of data
+        held in it. Only counts payload data (arrays, bytes), which is what dominates session memory.
+        Queues can't be looked into, so their contents are counted by Session.queued()/dequeued() instead.
+    '''
+
+    if depth > 4 or obj is None: return 0
+    if isinstance(obj, np.ndarray): return obj.nbytes
+    if isinstance(obj, (bytes, bytearray, memoryview, str)): return len(obj)
+    if isinstance(obj, dict): return sum(buffer_bytes(v, depth + 1) for v in obj.values())
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return sum(buffer_bytes(v, depth + 1) for v in obj)
+    if hasattr(obj, 'payload'): return buffer_bytes(obj.payload, depth + 1)
+    return 0
+
+
+class Session:
+    '''
+        Single webcam connection. Tasks started with spawn() and buffers registered with track() belong to the
+        session and are cancelled/cleared by close(). Whatever puts items into or takes them out of the session's
+        queues reports it with queued()/dequeued(), so bytes waiting in queues are known without looking inside them.
+    '''
+
+    def __init__(self, session_id: int, websocket: WebSocket, idle_seconds: float, max_seconds: float):
+        self.id = session_id
+        self.websocket = websocket
+        self.idle_seconds = idle_seconds
+        self.max_seconds = max_seconds
+        self.started = time.monotonic()
+        self.last_activity = self.started
+        self.tasks = set()
+        self.buffers = {}
+        self.queued_bytes = 0
+        self.close_reason = None
+
+    def spawn(self, coro, name: str):
+        task = asyncio.create_task(coro, name=name)
+        self.tasks.add(task)
+        return task
+
+    def track(self, name: str, buffer):
+        self.buffers[name] = buffer
+        return buffer
+
+    def queued(self, item):
+        self.queued_bytes += buffer_bytes(item)
+
+    def dequeued(self, item):
+        self.queued_bytes -= buffer_bytes(item)
+
+    def touch(self):
+        '''
+            Marks session as active (called for every message received from client).
+        '''
+
+        self.last_activity = time.monotonic()
+
+    async def run(self):
+        '''
+            Waits until one of the session's tasks finishes or a timeout is reached. Returns (and records) reason the
+            session should end; if the finished task raised, its exception is raised here instead.
+        '''
+
+        while self.close_reason is None:
+            now = time.monotonic()
+            idle_left = self.idle_seconds - (now - self.last_activity)
+            total_left = self.max_seconds - (now - self.started)
+            if total_left <= 0:
+                self.close_reason = 'max duration reached'
+            elif idle_left <= 0:
+                self.close_reason = 'idle timeout'
+            else:
+                done, _ = await asyncio.wait(self.tasks, timeout=min(idle_left, total_left), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None:
+                        self.close_reason = type(task.exception()).__name__
+                        raise task.exception()
+                if done:
+                    self.close_reason = f'{done.pop().get_name()} finished'
+
+        return self.close_reason
+
+    async def close(self, reason: str = 'session ended'):
+        '''
+            Cancels and awaits all tasks, clears buffers and closes socket if still open. Safe to call more than once.
+        '''
+
+        self.close_reason = self.close_reason or reason
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        # Awaiting so nothing still holds frames once close returns; exceptions were already handled (or are irrelevant now)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks.clear()
+
+        for buffer in self.buffers.values():
+            if isinstance(buffer, asyncio.Queue):
+                while not buffer.empty():
+                    buffer.get_nowait()
+            elif hasattr(buffer, 'clear'):
+                buffer.clear()
+        self.buffers.clear()
+        self.queued_bytes = 0
+
+        if self.websocket.application_state == WebSocketState.CONNECTED and self.websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                await self.websocket.close(code=1000, reason=self.close_reason[:120])
+            except (RuntimeError, OSError):
+                pass # Client went away meanwhile
+
+    def stats(self):
+        now = time.monotonic()
+        buffers = {name: buffer_bytes(buffer) for name, buffer in self.buffers.items() if not isinstance(buffer, asyncio.Queue)}
+        buffers['queues'] = self.queued_bytes
+        return {
+            'id': self.id,
+            'age_seconds': round(now - self.started, 1),
+            'idle_seconds': round(now - self.last_activity, 1),
+            'tasks': sum(1 for task in self.tasks if not task.done()),
+            'memory_bytes': sum(buffers.values()),
+            'buffers': buffers
+        }
+
+
+class SessionManager:
+    '''
+        Registry of live sessions. open() guarantees a session is closed and forgotten on every exit path.
+    '''
+
+    def __init__(self, idle_seconds: float = SESSION_IDLE_SECONDS, max_seconds: float = SESSION_MAX_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.max_seconds = max_seconds
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        self.closed = 0
+        self.close_reasons = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(SESSION_IDLE_SECONDS, SESSION_MAX_SECONDS)
+
+    @asynccontextmanager
+    async def open(self, websocket: WebSocket):
+        session = Session(next(self.ids), websocket, self.idle_seconds, self.max_seconds)
+        self.sessions[session.id] = session
+        try:
+            yield session
+        finally:
+            try:
+                await session.close()
+            finally:
+                del self.sessions[session.id]
+                self.closed += 1
+                self.close_reasons[session.close_reason] = self.close_reasons.get(session.close_reason, 0) + 1
+
+    def stats(self):
+        sessions = [session.stats() for session in self.sessions.values()]
+        return {
+            'active': len(sessions),
+            'closed': self.closed,
+            'close_reasons': dict(self.close_reasons),
+            'tasks': sum(s['tasks'] for s in sessions),
+            'memory_bytes': sum(s['memory_bytes'] for s in sessions),
+            'sessions': sessions
+        }
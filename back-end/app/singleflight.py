@@ -0,0 +1,100 @@
+# singleflight.py
+'''
+    Request coalescing: concurrent calls with the same key share one execution instead of each doing the work.
+'''
+
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    '''
+        Runs at most one call per key at a time. Callers arriving while a call for their key is in progress
+        wait for it and receive its result (or exception). Nothing is cached once the call finishes.
+        do() and do_async() coalesce separately: blocking callers share threads, async callers share futures.
+    '''
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.futures = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        '''
+            Calls fn(*args, **kwargs) unless a call with the same key is already running, in which case waits for its result.
+            Blocking, safe to call from any thread.
+        '''
+
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.executed += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None: raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        '''
+            Same as do() for event loop callers. Only the first caller uses a worker thread to run fn; the others await
+            its future without holding a thread. Shielded so a cancelled caller doesn't cancel the call for the rest.
+        '''
+
+        future = self.futures.get(key)
+        if future is None:
+            future = self.futures[key] = asyncio.ensure_future(asyncio.to_thread(fn, *args, **kwargs))
+            future.add_done_callback(lambda f: self._finish(key, f))
+            with self.lock:
+                self.executed += 1
+        else:
+            with self.lock:
+                self.coalesced += 1
+
+        return await asyncio.shield(future)
+
+    def _finish(self, key, future):
+        if self.futures.get(key) is future:
+            del self.futures[key]
+        if not future.cancelled():
+            future.exception() # Retrieving so an error nobody waited for isn't reported as never retrieved
+
+    def stats(self):
+        with self.lock:
+            in_flight = len(self.calls) + len(self.futures)
+        total = self.executed + self.coalesced
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'coalesced_ratio': self.coalesced / total if total else 0.0,
+            'in_flight': in_flight
+        }
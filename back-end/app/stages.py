@@ -0,0 +1,70 @@
+# stages.py
+'''
+    Small staged pipeline for per-session frame processing. Each stage runs as its own task and hands results to
+    the next through a bounded queue, so while one frame is in inference the next can be decoded and the previous
+    encoded. Heavy work inside a stage goes to a worker thread (OpenCV and the model release the GIL), so stages
+    really overlap and throughput is bounded by the slowest stage instead of the sum of all of them.
+'''
+
+import time
+import asyncio
+
+# Returned by a stage function to end the pipeline (e.g. once recommendations have been sent)
+STOP = object()
+
+
+class Stage:
+    '''
+        One pipeline step. fn is an async function taking an item from inbox and returning item for outbox,
+        None to drop it, or STOP to end. Putting into a full outbox waits, so a slow stage backs up the ones
+        before it until the frame queue at the front starts dropping frames.
+        session (sessions.Session) is told about every item taken from inbox and put into outbox, so it knows the
+        bytes waiting in its queues.
+    '''
+
+    def __init__(self, name: str, fn, inbox: asyncio.Queue, outbox: asyncio.Queue = None, session=None):
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.session = session
+        self.started = time.monotonic()
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+
+    async def run(self):
+        while True:
+            item = await self.inbox.get()
+            if self.session is not None: self.session.dequeued(item)
+
+            start = time.monotonic()
+            result = await self.fn(item)
+            self.busy_seconds += time.monotonic() - start
+            self.processed += 1
+
+            if result is STOP: return
+            if result is None or self.outbox is None: continue
+
+            start = time.monotonic()
+            await self.outbox.put(result)
+            if self.session is not None: self.session.queued(result)
+            self.blocked_seconds += time.monotonic() - start
+
+    def stats(self):
+        '''
+            Occupancy is share of time spent working on items; blocked is share spent waiting for next stage to make room.
+        '''
+
+        duration = time.monotonic() - self.started
+        return {
+            'processed': self.processed,
+            'occupancy': round(self.busy_seconds / duration, 3) if duration > 0 else 0.0,
+            'blocked': round(self.blocked_seconds / duration, 3) if duration > 0 else 0.0,
+            'avg_ms': round(self.busy_seconds / self.processed * 1000, 2) if self.processed else None,
+            'queued': self.inbox.qsize()
+        }
+
+
+def stage_stats(stages):
+    return {stage.name: stage.stats() for stage in stages}
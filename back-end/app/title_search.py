@@ -0,0 +1,446 @@
+# title_search.py
+'''
+    In-process BM25 search over product titles, built from a catalog snapshot (see catalog_snapshot.py).
+    Titles are tokenized into words plus canonical keyword terms from catalog_keywords.py, so "navy tee" also finds
+    "Blue Graphic T-Shirt". The index is a set of flat arrays that are memory-mapped on open:
+
+        meta.json                   version, snapshot version, document count, average title length, BM25 parameters
+        terms.heap                  UTF-8 bytes of every term, concatenated in sorted order
+        terms.offsets.npy           (V + 1,) int64 start of each term in heap
+        postings.offsets.npy        (V + 1,) int64 start of each term's postings
+        postings.docs.npy           int32 snapshot row ids, ascending within each term
+        postings.tf.npy             uint16 term frequency for each posting
+        champions.offsets.npy       (V + 1,) int64 start of each term's champion list
+        champions.docs.npy          int32 rows of each term's highest-impact postings, ascending within each term
+        doc_lengths.npy             (N,) uint16 number of terms in each title
+
+    Row ids are snapshot rows, so results and gender/color/clothing_class filters come straight from the snapshot.
+    Like the snapshot, the output path is a symlink switched atomically to each newly built version.
+
+    python title_search.py --snapshot catalog/ --output catalog_search/
+'''
+
+import os
+import re
+import mmap
+import json
+import argparse
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from catalog_keywords import CLOTHING_TYPE_MAP, COLOR_MAP
+from catalog_snapshot import CatalogSnapshot, new_version, publish, resolve
+
+INDEX_VERSION = 1
+FILTER_COLUMNS = ('gender', 'color', 'clothing_class')
+
+CHAMPIONS = 1000 # Highest-impact postings kept per term for queries made only of common terms
+EXACT_LIMIT = 10000 # Queries whose rarest token matches at most this many titles are answered exactly
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+KEYWORD_PREFIX = '#' # Can't appear in word tokens, so canonical terms never collide with title words
+
+
+def tokenize(text: str):
+    '''
+        Takes in text and returns list of lowercase word tokens. Apostrophes are dropped so "women's" is one token.
+    '''
+
+    return TOKEN_PATTERN.findall(text.lower().replace("'", ''))
+
+
+def _keyword_phrases():
+    '''
+        Returns dict mapping keyword token tuples (e.g. ('t', 'shirt')) to canonical terms (e.g. '#t-shirt').
+    '''
+
+    phrases = {}
+    for keyword_map in (CLOTHING_TYPE_MAP, COLOR_MAP):
+        for canonical, keywords in keyword_map.items():
+            for keyword in [canonical] + keywords:
+                phrases.setdefault(tuple(tokenize(keyword)), KEYWORD_PREFIX + canonical)
+    return phrases
+
+
+KEYWORD_PHRASES = _keyword_phrases()
+MAX_PHRASE = max(len(phrase) for phrase in KEYWORD_PHRASES)
+
+
+def keyword_terms(tokens):
+    '''
+        Takes in list of tokens and returns list of (start, end, canonical term) for keyword phrases found in them.
+        Longest phrase wins at each position, so "t shirt" is a t-shirt rather than a shirt.
+    '''
+
+    found = []
+    i = 0
+    while i < len(tokens):
+        for length in range(min(MAX_PHRASE, len(tokens) - i), 0, -1):
+            canonical = KEYWORD_PHRASES.get(tuple(tokens[i:i + length]))
+            if canonical is not None:
+                found.append((i, i + length, canonical))
+                i += length
+                break
+        else:
+            i += 1
+    return found
+
+
+def analyze(title: str):
+    '''
+        Takes in title and returns list of terms indexed for it: its tokens followed by canonical keyword terms.
+    '''
+
+    tokens = tokenize(title)
+    return tokens + [canonical for _, _, canonical in keyword_terms(tokens)]
+
+
+def build_index(snapshot: CatalogSnapshot, output: str, k1: float = 1.2, b: float = 0.75, champions: int = CHAMPIONS):
+    '''
+        Builds index for every title in snapshot and writes it to output directory. Postings are collected as flat
+        (term, row, tf) arrays and sorted once at the end, so memory stays proportional to total postings.
+        Each term also gets a champion list of its `champions` postings with the highest BM25 term score.
+    '''
+
+    vocabulary = {}
+    term_ids = array('i')
+    rows = array('i')
+    tfs = array('H')
+    doc_lengths = np.zeros(len(snapshot), dtype=np.uint16)
+
+    # Reading title column directly rather than through snapshot.string(), which is slow per row
+    heap = bytes(snapshot.heaps['title'])
+    offsets = snapshot.offsets['title'].tolist()
+    for row in range(len(snapshot)):
+        terms = analyze(heap[offsets[row]:offsets[row + 1]].decode('utf-8'))
+        doc_lengths[row] = min(len(terms), 65535)
+        for term, tf in Counter(terms).items():
+            term_id = vocabulary.setdefault(term, len(vocabulary))
+            term_ids.append(term_id)
+            rows.append(row)
+            tfs.append(min(tf, 65535))
+
+    # Renumbering terms in sorted UTF-8 order so lookups (and prefix ranges) are binary searches over the heap
+    terms = sorted(vocabulary, key=lambda t: t.encode('utf-8'))
+    new_ids = np.empty(len(terms), dtype=np.int64)
+    new_ids[[vocabulary[t] for t in terms]] = np.arange(len(terms))
+
+    term_ids = new_ids[np.frombuffer(term_ids, dtype=np.int32)] if len(term_ids) else np.zeros(0, dtype=np.int64)
+    order = np.argsort(term_ids, kind='stable') # Stable keeps rows ascending within each term
+    post_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    post_offsets[1:] = np.cumsum(np.bincount(term_ids, minlength=len(terms)))
+
+    post_terms = term_ids[order]
+    post_docs = np.frombuffer(rows, dtype=np.int32)[order]
+    post_tf = np.frombuffer(tfs, dtype=np.uint16)[order]
+
+    # Champion lists: rank each term's postings by BM25 term score (idf is the same within a term) and keep the top ones
+    avg_length = float(doc_lengths.mean()) if len(snapshot) else 0.0
+    tf = post_tf.astype(np.float32)
+    impact = tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_lengths[post_docs] / max(avg_length, 1.0)))
+    by_impact = np.lexsort((-impact, post_terms))
+    rank = np.arange(len(by_impact)) - post_offsets[post_terms[by_impact]]
+    kept = np.sort(by_impact[rank < champions]) # Back in (term, row) order
+    champion_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    champion_offsets[1:] = np.cumsum(np.bincount(post_terms[kept], minlength=len(terms)))
+
+    encoded = [t.encode('utf-8') for t in terms]
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(t) for t in encoded])
+
+    version_path = new_version(output)
+
+    with open(os.path.join(version_path, 'terms.heap'), 'wb') as f:
+        f.write(b''.join(encoded))
+    np.save(os.path.join(version_path, 'terms.offsets.npy'), term_offsets)
+    np.save(os.path.join(version_path, 'postings.offsets.npy'), post_offsets)
+    np.save(os.path.join(version_path, 'postings.docs.npy'), post_docs)
+    np.save(os.path.join(version_path, 'postings.tf.npy'), post_tf)
+    np.save(os.path.join(version_path, 'champions.offsets.npy'), champion_offsets)
+    np.save(os.path.join(version_path, 'champions.docs.npy'), post_docs[kept])
+    np.save(os.path.join(version_path, 'doc_lengths.npy'), doc_lengths)
+
+    with open(os.path.join(version_path, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': INDEX_VERSION,
+            'count': len(snapshot),
+            'snapshot': os.path.basename(snapshot.path), # Version directory, so a rebuilt snapshot is never mistaken for this one
+            'terms': len(terms),
+            'avg_length': avg_length,
+            'k1': k1,
+            'b': b,
+            'champions': champions
+        }, f)
+
+    # Switching symlink so readers see either the old index or the complete new one
+    publish(version_path, output)
+
+    return len(terms)
+
+
+class TitleIndex:
+    '''
+        Read-only, memory-mapped title index. Query cost depends on the candidate set, never on catalog size:
+        candidates are the rarest query token's postings if it's rare enough (exact), otherwise the champion
+        lists of all tokens (approximate top-k). Candidates are filtered first and then every token is scored for
+        them by binary search in its postings. Titles containing every token are preferred; if fewer than k do,
+        titles with any token are ranked as well, and champion candidates fall back to the exact path last.
+    '''
+
+    def __init__(self, path: str, snapshot: CatalogSnapshot, max_expansions: int = 20, exact_limit: int = EXACT_LIMIT):
+        path = resolve(path) # Every array comes from the same version even if a new one is published meanwhile
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_VERSION:
+            raise ValueError(f"Unsupported title index version {meta['version']}")
+        if meta.get('snapshot') != os.path.basename(snapshot.path):
+            raise ValueError(f"Title index was built from snapshot {meta.get('snapshot')} but {os.path.basename(snapshot.path)} is open, rebuild it")
+
+        self.snapshot = snapshot
+        self.count = meta['count']
+        self.avg_length = meta['avg_length'] or 1.0
+        self.k1 = meta['k1']
+        self.b = meta['b']
+        self.max_expansions = max_expansions
+        self.exact_limit = exact_limit
+
+        self.heap = b''
+        heap_path = os.path.join(path, 'terms.heap')
+        if os.path.getsize(heap_path) > 0: # Can't memory-map empty file
+            with open(heap_path, 'rb') as f:
+                self.heap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.term_offsets = self._load(path, 'terms.offsets.npy')
+        self.post_offsets = self._load(path, 'postings.offsets.npy')
+        self.post_docs = self._load(path, 'postings.docs.npy')
+        self.post_tf = self._load(path, 'postings.tf.npy')
+        self.champion_offsets = self._load(path, 'champions.offsets.npy')
+        self.champion_docs = self._load(path, 'champions.docs.npy')
+        self.doc_lengths = self._load(path, 'doc_lengths.npy')
+        self.terms = len(self.term_offsets) - 1
+
+    @staticmethod
+    def _load(path: str, name: str):
+        # Plain ndarray view of the memory map; indexing np.memmap itself is several times slower
+        return np.load(os.path.join(path, name), mmap_mode='r').view(np.ndarray)
+
+    def _term(self, i: int):
+        return self.heap[int(self.term_offsets[i]):int(self.term_offsets[i + 1])]
+
+    def _lower_bound(self, key: bytes):
+        lo, hi = 0, self.terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, term: str):
+        '''
+            Returns id of term, or None if it isn't in the index.
+        '''
+
+        key = term.encode('utf-8')
+        i = self._lower_bound(key)
+        return i if i < self.terms and self._term(i) == key else None
+
+    def prefix(self, prefix: str):
+        '''
+            Returns ids of up to max_expansions terms starting with prefix, most frequent first.
+        '''
+
+        key = prefix.encode('utf-8')
+        start = self._lower_bound(key)
+        end = self._lower_bound(key + b'\xff') # No UTF-8 byte sequence continues with 0xff
+        if end - start <= self.max_expansions:
+            return list(range(start, end))
+
+        df = np.diff(self.post_offsets[start:end + 1])
+        top = np.argsort(-df, kind='stable')[:self.max_expansions]
+        return (start + top).tolist()
+
+    def fuzzy(self, term: str):
+        '''
+            Returns ids of terms one deletion or adjacent transposition away from term, to tolerate common typos.
+        '''
+
+        if len(term) < 4: return []
+        variants = {term[:i] + term[i + 1:] for i in range(len(term))}
+        variants.update(term[:i] + term[i + 1] + term[i] + term[i + 2:] for i in range(len(term) - 1))
+        variants.discard(term)
+        return [i for i in (self.lookup(v) for v in variants) if i is not None]
+
+    def _query_groups(self, query: str, prefix: bool):
+        '''
+            Takes in query and returns list of term id groups, one per query token. A document matches a group if
+            it contains any of its terms: the token itself (or its prefix completions/typo corrections) and the
+            canonical keyword term of any phrase the token is part of.
+        '''
+
+        tokens = tokenize(query)
+        canonical = [[] for _ in tokens]
+        for start, end, term in keyword_terms(tokens):
+            for i in range(start, end):
+                canonical[i].append(term)
+
+        groups = []
+        for i, token in enumerate(tokens):
+            if prefix and i == len(tokens) - 1:
+                ids = self.prefix(token)
+            else:
+                term_id = self.lookup(token)
+                ids = [term_id] if term_id is not None else []
+            if not ids:
+                ids = self.fuzzy(token)
+            ids += [term_id for term_id in map(self.lookup, canonical[i]) if term_id is not None]
+            if ids:
+                groups.append(sorted(set(ids)))
+        return groups
+
+    def _postings(self, term_id: int):
+        start, end = self.post_offsets[term_id], self.post_offsets[term_id + 1]
+        return self.post_docs[start:end], self.post_tf[start:end]
+
+    def _idf(self, df: int):
+        return np.log(1 + (self.count - df + 0.5) / (df + 0.5))
+
+    def _df(self, group):
+        return int(sum(self.post_offsets[term_id + 1] - self.post_offsets[term_id] for term_id in group))
+
+    def _group_docs(self, group, champions: bool = False):
+        '''
+            Returns ascending rows containing any of group's terms, or only their champion postings.
+        '''
+
+        if champions:
+            docs = [self.champion_docs[self.champion_offsets[term_id]:self.champion_offsets[term_id + 1]] for term_id in group]
+        else:
+            docs = [self._postings(term_id)[0] for term_id in group]
+        return docs[0] if len(docs) == 1 else np.unique(np.concatenate(docs))
+
+    def _candidates(self, groups, filters: dict, champions: bool):
+        if champions:
+            # Rare groups contribute all their postings, common ones only their champions
+            docs = [self._group_docs(group, self._df(group) > self.exact_limit) for group in groups]
+            docs = docs[0] if len(docs) == 1 else np.unique(np.concatenate(docs))
+        else:
+            docs = np.unique(np.concatenate([self._group_docs(group) for group in groups]))
+        return self._filter(docs, filters)
+
+    def _group_scores(self, group, docs, norm):
+        '''
+            Takes in term group, ascending candidate rows and their BM25 length normalization. Returns best BM25 score
+            among group's terms for each candidate (0 where no term occurs).
+        '''
+
+        if len(group) > 1 and self._df(group) <= self.exact_limit:
+            return self._merged_group_scores(group, docs)
+
+        best = np.zeros(len(docs), dtype=np.float32)
+        for term_id in group:
+            term_docs, term_tf = self._postings(term_id)
+            pos = np.minimum(np.searchsorted(term_docs, docs), len(term_docs) - 1)
+            tf = np.where(term_docs[pos] == docs, term_tf[pos], 0).astype(np.float32)
+            scores = self._idf(len(term_docs)) * tf * (self.k1 + 1) / (tf + norm)
+            np.maximum(best, scores, out=best)
+        return best
+
+    def _merged_group_scores(self, group, docs):
+        '''
+            Same as _group_scores for groups with few postings in total (e.g. prefix completions): scores every posting
+            once, keeps best per row and looks candidates up in that, instead of one binary search per term.
+        '''
+
+        postings = [self._postings(term_id) for term_id in group]
+        term_docs = np.concatenate([d for d, _ in postings])
+        tf = np.concatenate([t for _, t in postings]).astype(np.float32)
+        idf = np.repeat([self._idf(len(d)) for d, _ in postings], [len(d) for d, _ in postings]).astype(np.float32)
+
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[term_docs] / self.avg_length)
+        scores = idf * tf * (self.k1 + 1) / (tf + norm)
+
+        # Sorting by row then descending score, so first posting of each row holds its best score
+        order = np.lexsort((-scores, term_docs))
+        term_docs, scores = term_docs[order], scores[order]
+        first = np.ones(len(term_docs), dtype=bool)
+        first[1:] = term_docs[1:] != term_docs[:-1]
+        term_docs, scores = term_docs[first], scores[first]
+
+        pos = np.minimum(np.searchsorted(term_docs, docs), len(term_docs) - 1)
+        return np.where(term_docs[pos] == docs, scores[pos], 0).astype(np.float32)
+
+    def _filter(self, docs, filters: dict):
+        for name, value in filters.items():
+            code = self.snapshot.lookups[name].get(value)
+            if code is None: return docs[:0]
+            docs = docs[self.snapshot.codes[name][docs] == code]
+        return docs
+
+    def _score(self, groups, docs, require_all: bool):
+        norm = (self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_length)).astype(np.float32)
+        total = np.zeros(len(docs), dtype=np.float32)
+        matched = np.ones(len(docs), dtype=bool)
+        for group in groups:
+            scores = self._group_scores(group, docs, norm)
+            total += scores
+            matched &= scores > 0
+        return (docs[matched], total[matched]) if require_all else (docs, total)
+
+    def search(self, query: str, k: int = 10, prefix: bool = True, **filters):
+        '''
+            Takes in query text, number of results, whether last token may be a prefix and optional exact-match
+            filters on gender/color/clothing_class. Returns list of (snapshot row, score), best first.
+        '''
+
+        unknown = set(filters) - set(FILTER_COLUMNS)
+        if unknown:
+            raise ValueError(f"Can't filter on {', '.join(sorted(unknown))}")
+        filters = {name: value for name, value in filters.items() if value}
+
+        groups = self._query_groups(query, prefix)
+        if not groups: return []
+
+        sizes = [self._df(group) for group in groups]
+        rarest = groups[int(np.argmin(sizes))]
+        approximate = min(sizes) > self.exact_limit
+
+        if approximate:
+            docs, scores = self._score(groups, self._candidates(groups, filters, champions=True), require_all=True)
+        else:
+            docs, scores = self._score(groups, self._filter(self._group_docs(rarest), filters), require_all=True)
+
+        if len(docs) < k and len(groups) > 1:
+            # Not enough titles contain every token, so ranking titles containing at least one
+            docs, scores = self._score(groups, self._candidates(groups, filters, champions=True), require_all=False)
+
+        if len(docs) < k and approximate:
+            # Champion lists didn't survive filters; exact answer is expensive but this is rare
+            docs, scores = self._score(groups, self._candidates(groups, filters, champions=False), require_all=len(groups) == 1)
+
+        if len(docs) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            docs, scores = docs[top], scores[top]
+        order = np.lexsort((docs, -scores)) # Ties broken by row so results are stable
+        return [(int(docs[i]), float(scores[i])) for i in order]
+
+    def records(self, query: str, k: int = 10, prefix: bool = True, **filters):
+        '''
+            Same as search() but returns snapshot records with their score under 'score'.
+        '''
+
+        return [{**self.snapshot.record(row), 'score': round(score, 4)} for row, score in self.search(query, k, prefix, **filters)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build title search index from catalog snapshot')
+    parser.add_argument('--snapshot', required=True, help='Catalog snapshot directory written by import_amazon_products.py --snapshot')
+    parser.add_argument('--output', required=True, help='Directory to write index to')
+
+    args = parser.parse_args()
+    snapshot = CatalogSnapshot(args.snapshot)
+    terms = build_index(snapshot, args.output)
+    print(f"Indexed {len(snapshot)} titles with {terms} distinct terms into {args.output}")
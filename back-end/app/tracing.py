@@ -0,0 +1,170 @@
+# tracing.py
+'''
+    Lightweight span tracing grouped by request or webcam session. Spans go into a bounded in-memory ring and can be
+    exported as Chrome trace JSON (open in chrome://tracing or https://ui.perfetto.dev).
+
+    Sampling is decided once per trace, so unsampled requests only pay for a context variable lookup per span.
+    The current trace is held in a contextvar, which asyncio tasks and asyncio.to_thread() inherit automatically.
+'''
+
+import os
+import time
+import uuid
+import functools
+import random
+import itertools
+import threading
+import contextvars
+from collections import deque
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    __slots__ = ('trace_id', 'name', 'pid')
+
+    def __init__(self, trace_id: str, name: str, pid: int):
+        self.trace_id = trace_id
+        self.name = name
+        self.pid = pid
+
+
+class Span:
+    '''
+        Context manager recording one span in the current trace. No-op when current request isn't sampled.
+    '''
+
+    __slots__ = ('tracer', 'name', 'args', 'trace', 'start')
+
+    def __init__(self, tracer, name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.tracer.record(self.trace, self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+class TraceScope:
+    '''
+        Context manager making a (possibly unsampled) trace current for the code inside it.
+    '''
+
+    __slots__ = ('trace', 'token')
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        _current.reset(self.token)
+        return False
+
+
+class Tracer:
+    '''
+        Holds sampling settings and the ring of finished spans. Appends to a deque are atomic so spans can be recorded
+        from worker threads without locking.
+    '''
+
+    def __init__(self, sample_rate: float, capacity: int):
+        self.sample_rate = sample_rate
+        self.events = deque(maxlen=capacity)
+        self.traces = deque(maxlen=1024) # Trace names for export metadata
+        self.pids = itertools.count(1)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', '0.01')),
+            capacity=int(os.getenv('TRACE_CAPACITY', '100000'))
+        )
+
+    def trace(self, name: str, trace_id: str = None, force: bool = False):
+        '''
+            Starts trace for request or session. Returns context manager yielding Trace, or None if not sampled.
+        '''
+
+        if not force and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return TraceScope(None)
+
+        trace = Trace(trace_id or uuid.uuid4().hex[:16], name, next(self.pids))
+        self.traces.append(trace)
+        return TraceScope(trace)
+
+    def span(self, name: str, **args):
+        return Span(self, name, args)
+
+    def record(self, trace: Trace, name: str, start_ns: int, end_ns: int, args: dict):
+        self.events.append((trace.pid, threading.get_ident(), name, start_ns, end_ns, args))
+
+    def export(self, trace_id: str = None):
+        '''
+            Returns buffered spans as Chrome trace JSON dict. Each trace is shown as its own process row, with one thread
+            row per OS thread that did work for it. Optionally filtered to a single trace id.
+        '''
+
+        traces = {t.pid: t for t in list(self.traces)}
+        if trace_id is not None:
+            traces = {pid: t for pid, t in traces.items() if t.trace_id == trace_id}
+
+        events = []
+        for pid, trace in traces.items():
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': f'{trace.name} {trace.trace_id}'}})
+
+        for pid, tid, name, start_ns, end_ns, args in list(self.events):
+            if pid not in traces: continue
+            events.append({
+                'name': name,
+                'ph': 'X',
+                'pid': pid,
+                'tid': tid,
+                'ts': start_ns / 1000,
+                'dur': (end_ns - start_ns) / 1000,
+                'args': args
+            })
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+tracer = Tracer.from_env()
+span = tracer.span
+
+
+def traced(name: str):
+    '''
+        Decorator recording every call of a function as a span in the current trace.
+    '''
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_request(name: str):
+    '''
+        Decorator for async endpoints starting a new (sampled) trace for each request.
+    '''
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with tracer.trace(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
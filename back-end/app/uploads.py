@@ -0,0 +1,123 @@
+# uploads.py
+'''
+    Bounded upload handling. Request bodies are size-checked while streaming, image dimensions are probed from the
+    header before decoding, and large photos are decoded straight to the resolution detection actually uses.
+'''
+
+import os
+import json
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from fastapi import UploadFile, HTTPException
+
+MAX_FILE_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', str(100 * 1024 * 1024)))
+MAX_PIXELS = int(os.getenv('MAX_UPLOAD_PIXELS', str(50_000_000)))
+DETECT_MAX_SIDE = int(os.getenv('DETECT_MAX_SIDE', '1280')) # Model runs at 640, extra margin keeps color crops detailed
+
+READ_CHUNK = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    '''
+        Exception that is raised when upload exceeds byte or pixel limits.
+    '''
+    pass
+
+
+async def read_limited(file: UploadFile, max_bytes: int = MAX_FILE_BYTES):
+    '''
+        Takes in UploadFile and returns its bytes, raising UploadTooLarge as soon as more than max_bytes have been read.
+    '''
+
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(READ_CHUNK)
+        if not chunk: break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(f'File exceeds {max_bytes // (1024 * 1024)} MB limit')
+        chunks.append(chunk)
+
+    return b''.join(chunks)
+
+
+def decode_downscaled(image_bytes: bytes, max_side: int = DETECT_MAX_SIDE, max_pixels: int = MAX_PIXELS):
+    '''
+        Takes in bytes representing image and returns (NumPy RGB array, scale) where scale is original size / decoded size.
+        Dimensions are read from the header first so oversized images are rejected before any pixel is decoded.
+        JPEGs are decoded at a reduced DCT scale (1/2, 1/4, 1/8) so a 40 megapixel photo never exists at full size in memory.
+    '''
+
+    img = Image.open(BytesIO(image_bytes)) # Lazy: only header parsed so far
+    width, height = img.size
+    if width * height > max_pixels:
+        raise UploadTooLarge(f'Image has {width * height} pixels, limit is {max_pixels}')
+
+    if max(width, height) > max_side:
+        target = (max(1, width * max_side // max(width, height)), max(1, height * max_side // max(width, height)))
+        img.draft('RGB', target) # No-op for formats without decode-time scaling
+        img = img.convert('RGB') if img.mode != 'RGB' else img
+        img.thumbnail(target, Image.BILINEAR)
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    arr = np.asarray(img)
+    scale = width / arr.shape[1]
+    return arr, scale
+
+
+def scale_box(bbox, scale: float):
+    '''
+        Takes in (x1, y1, x2, y2) box in decoded image coordinates and returns it in original image coordinates.
+    '''
+
+    return [round(float(v) * scale, 1) for v in bbox]
+
+
+class BodyLimitMiddleware:
+    '''
+        ASGI middleware rejecting request bodies larger than max_bytes with 413. Checks Content-Length up front and
+        counts bytes as they stream in (for chunked uploads), so oversized uploads are cut off before they are buffered.
+    '''
+
+    def __init__(self, app, max_bytes: int, paths):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get('headers', []):
+            if name == b'content-length' and value.isdigit() and int(value) > self.max_bytes:
+                await self._reject(send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    # HTTPException passes through FastAPI's body parsing and is turned into a 413 response
+                    raise HTTPException(status_code=413, detail='Request body too large')
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = json.dumps({'error': f'Request body exceeds {self.max_bytes // (1024 * 1024)} MB limit'}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 413,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
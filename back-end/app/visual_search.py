@@ -0,0 +1,328 @@
+# visual_search.py
+'''
+    Visual similarity search over catalog product images. Each image (or detected garment crop) is described by an
+    HSV color histogram, optionally concatenated with a pooled YOLO backbone embedding, and stored in a memory-mapped
+    index searched by cosine similarity. Large indexes are split into inverted lists (IVF) so a query only scans
+    the few lists closest to it.
+
+    python visual_search.py --images product_images/ --output visual_index/
+    python visual_search.py --images product_images/ --output visual_index/ --embed --weights best.pt --nlist 1024
+
+    Product images are expected to be named after the product they show, e.g. <parent_asin>.jpg.
+    Like the catalog snapshot, the output path is a symlink switched atomically to each newly built version, so a
+    rebuild never changes files a running server has memory-mapped.
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+import argparse
+
+import numpy as np
+import cv2
+
+from catalog_snapshot import new_version, publish, resolve
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+HIST_BINS = (8, 4, 4) # Hue, saturation, value
+HIST_SIZE = 128 # Longest side crops are shrunk to before computing histogram
+
+INDEX_VERSION = 1
+
+
+def color_histogram(crop: np.ndarray):
+    '''
+        Takes in NumPy array representing RGB image and returns unit-length HSV histogram descriptor.
+        Square root of normalized histogram (Hellinger kernel) so cosine similarity isn't dominated by a single large bin.
+    '''
+
+    h, w = crop.shape[:2]
+    if h == 0 or w == 0:
+        return np.zeros(int(np.prod(HIST_BINS)), dtype=np.float32) # Empty crop has no colors (and no similarity to anything)
+    scale = HIST_SIZE / max(h, w)
+    if scale < 1:
+        crop = cv2.resize(crop, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+    hsv = cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_RGB2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, list(HIST_BINS), [0, 180, 0, 256, 0, 256]).ravel()
+    total = hist.sum()
+    if total > 0:
+        hist /= total
+    return np.sqrt(hist, dtype=np.float32)
+
+
+def backbone_embeddings(model, crops: list[np.ndarray]):
+    '''
+        Takes in YOLO model and list of RGB crops and returns (N, D) array of unit-length pooled backbone embeddings.
+    '''
+
+    # Ultralytics expects BGR arrays
+    bgr = [cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_RGB2BGR) for crop in crops]
+    embeddings = np.stack([e.cpu().numpy().ravel() for e in model.embed(bgr, verbose=False)]).astype(np.float32)
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return embeddings
+
+
+def describe(crops: list[np.ndarray], model=None, color_weight: float = 0.5):
+    '''
+        Takes in list of RGB crops and returns (N, D) array of unit-length descriptors.
+        When model is given, histogram and embedding are concatenated with `color_weight` share of the similarity going to color.
+    '''
+
+    hists = np.stack([color_histogram(crop) for crop in crops])
+    if model is None:
+        return hists
+
+    embeddings = backbone_embeddings(model, crops)
+    return np.hstack([hists * np.sqrt(color_weight), embeddings * np.sqrt(1 - color_weight)]).astype(np.float32)
+
+
+def weights_digest(path: str):
+    '''
+        Takes in model weights path and returns SHA-256 of the file, identifying the embedding space it produces.
+    '''
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _kmeans_cosine(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0):
+    '''
+        Spherical k-means on unit vectors. Returns (k, D) unit centroids. Assignments computed in chunks to bound memory.
+    '''
+
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].astype(np.float32)
+
+    for _ in range(iterations):
+        labels = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors.astype(np.float32))
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))] # Reseed empty lists
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+    return centroids
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536):
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        labels[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def _top_k(scores: np.ndarray, k: int):
+    k = min(k, len(scores))
+    if k == 0: return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx], kind='stable')]
+
+
+class VisualIndex:
+    '''
+        Memory-mapped descriptor index. Directory layout:
+            meta.json       descriptor settings, dimension, count
+            vectors.npy     (N, D) float16 descriptors, grouped by inverted list
+            ids.npy         (N,) product ids in the same order
+            centroids.npy   (nlist, D) float32 list centroids (only for IVF)
+            offsets.npy     (nlist + 1,) start of each list in vectors.npy (only for IVF)
+    '''
+
+    def __init__(self, path: str):
+        path = resolve(path) # Every file comes from the same build even if a new one is published meanwhile
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != INDEX_VERSION:
+            raise ValueError(f"Unsupported visual index version {self.meta['version']}")
+
+        self.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        self.ids = np.load(os.path.join(path, 'ids.npy'), mmap_mode='r')
+        self.centroids = None
+        self.offsets = None
+        if self.meta['nlist'] > 0:
+            self.centroids = np.load(os.path.join(path, 'centroids.npy'))
+            self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+
+        self.embed_model = None # Set by load_embedding_model()
+        self.embed_lock = threading.Lock()
+
+    @property
+    def uses_embedding(self):
+        return self.meta['embedding']
+
+    def load_embedding_model(self, weights: str = None):
+        '''
+            Loads dedicated model for query embeddings from weights (default: path recorded at build time). Queries must
+            use exactly the weights catalog vectors were built with, so if they can't be found or differ, no model is
+            loaded and queries fall back to color only (see describe()).
+        '''
+
+        self.embed_model = None
+        if not self.uses_embedding: return
+
+        weights = weights or self.meta.get('weights')
+        if not weights or not os.path.exists(weights):
+            print(f"Visual index embedding weights {weights} not found, similar-items will compare color only")
+            return
+        if weights_digest(weights) != self.meta.get('weights_sha256'):
+            print(f"Weights {weights} don't match ones visual index was built with, similar-items will compare color only")
+            return
+
+        from ultralytics import YOLO
+        self.embed_model = YOLO(weights)
+
+    def describe(self, crops: list[np.ndarray]):
+        '''
+            Takes in list of RGB crops and returns query descriptors comparable with index vectors. Without a matching
+            embedding model the embedding part is left at zero, so similarity comes from color alone.
+        '''
+
+        if not self.uses_embedding:
+            return describe(crops)
+        if self.embed_model is not None:
+            with self.embed_lock: # YOLO models aren't safe to call from several threads at once
+                return describe(crops, self.embed_model, self.meta['color_weight'])
+
+        hists = describe(crops)
+        descriptors = np.zeros((len(hists), self.meta['dim']), dtype=np.float32)
+        descriptors[:, :hists.shape[1]] = hists # Histogram comes first in index vectors
+        return descriptors
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: int = 8):
+        '''
+            Takes in unit-length descriptor and returns list of (product id, cosine similarity) for k most similar products.
+        '''
+
+        query = np.asarray(query, dtype=np.float32)
+
+        if self.centroids is None:
+            # Flat scan in chunks so float16 -> float32 conversion never materializes the whole index
+            best_idx, best_scores = [], []
+            for start in range(0, len(self.vectors), 262144):
+                scores = np.asarray(self.vectors[start:start + 262144], dtype=np.float32) @ query
+                top = _top_k(scores, k)
+                best_idx.append(top + start)
+                best_scores.append(scores[top])
+            idx, scores = np.concatenate(best_idx), np.concatenate(best_scores)
+        else:
+            lists = _top_k(self.centroids @ query, nprobe)
+            idx = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            scores = np.asarray(self.vectors[idx], dtype=np.float32) @ query
+
+        top = _top_k(scores, k)
+        return [(str(self.ids[idx[i]]), float(scores[i])) for i in top]
+
+
+def build_index(image_dir: str, output: str, weights: str = None, nlist: int = 0, color_weight: float = 0.5, batch_size: int = 64):
+    '''
+        Computes descriptors for every image in image_dir and writes index to output directory.
+        With weights, YOLO backbone embeddings from that model are added; its path and hash are recorded so the server
+        embeds queries with the same model. nlist = 0 writes a flat index, otherwise vectors are grouped into nlist
+        inverted lists.
+    '''
+
+    paths = sorted(
+        os.path.join(image_dir, name) for name in os.listdir(image_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not paths:
+        raise ValueError(f"No images found in {image_dir}")
+
+    model = None
+    if weights:
+        from ultralytics import YOLO
+        model = YOLO(weights)
+
+    version_path = new_version(output)
+    raw_path = os.path.join(version_path, 'vectors.raw.npy')
+    raw = None
+    ids = []
+    count = 0
+
+    for start in range(0, len(paths), batch_size):
+        crops, batch_ids = [], []
+        for path in paths[start:start + batch_size]:
+            img = cv2.imread(path, cv2.IMREAD_COLOR)
+            if img is None:
+                print(f"Skipping unreadable image: {path}")
+                continue
+            crops.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            batch_ids.append(os.path.splitext(os.path.basename(path))[0])
+        if not crops: continue
+
+        descriptors = describe(crops, model, color_weight)
+        if raw is None:
+            # Written straight to disk so building never holds the whole catalog in memory
+            raw = np.lib.format.open_memmap(raw_path, mode='w+', dtype=np.float16, shape=(len(paths), descriptors.shape[1]))
+        raw[count:count + len(descriptors)] = descriptors
+        ids.extend(batch_ids)
+        count += len(descriptors)
+        print(f"Described {count}/{len(paths)} images")
+
+    if raw is None:
+        shutil.rmtree(version_path, ignore_errors=True)
+        raise ValueError(f"No readable images in {image_dir}")
+    raw.flush()
+    vectors = raw[:count]
+    dim = int(vectors.shape[1])
+    ids = np.array(ids)
+
+    if nlist > 0:
+        nlist = min(nlist, count)
+        sample = vectors[np.random.default_rng(0).choice(count, size=min(count, nlist * 64), replace=False)]
+        centroids = _kmeans_cosine(np.asarray(sample, dtype=np.float32), nlist)
+        labels = _assign(vectors, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]).astype(np.int64)
+        np.save(os.path.join(version_path, 'centroids.npy'), centroids)
+        np.save(os.path.join(version_path, 'offsets.npy'), offsets)
+    else:
+        order = np.arange(count)
+
+    final = np.lib.format.open_memmap(os.path.join(version_path, 'vectors.npy'), mode='w+', dtype=np.float16, shape=(count, dim))
+    for start in range(0, count, 65536):
+        final[start:start + 65536] = vectors[order[start:start + 65536]]
+    final.flush()
+    del final, raw, vectors
+    os.remove(raw_path)
+
+    np.save(os.path.join(version_path, 'ids.npy'), ids[order])
+    with open(os.path.join(version_path, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': INDEX_VERSION,
+            'count': count,
+            'dim': dim,
+            'nlist': nlist,
+            'embedding': model is not None,
+            'weights': os.path.abspath(weights) if weights else None,
+            'weights_sha256': weights_digest(weights) if weights else None,
+            'color_weight': color_weight,
+            'hist_bins': list(HIST_BINS)
+        }, f)
+
+    # Switching symlink so readers see either the old index or the complete new one
+    publish(version_path, output)
+    print(f"Completed! Indexed {count} images into {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build visual similarity index from catalog product images')
+    parser.add_argument('--images', required=True, help='Directory of product images named <product id>.<ext>')
+    parser.add_argument('--output', required=True, help='Index output directory')
+    parser.add_argument('--embed', action='store_true', help='Add YOLO backbone embedding to color histogram')
+    parser.add_argument('--weights', default='best.pt', help='YOLO model weights used with --embed')
+    parser.add_argument('--nlist', type=int, default=0, help='Number of inverted lists (0 for flat index)')
+    parser.add_argument('--color-weight', type=float, default=0.5, help='Share of similarity given to color when using --embed')
+    parser.add_argument('--batch', type=int, default=64, help='Images per descriptor batch')
+
+    args = parser.parse_args()
+
+    build_index(args.images, args.output, args.weights if args.embed else None, args.nlist, args.color_weight, args.batch)
@@ -0,0 +1,303 @@
+# wardrobe.py
+'''
+    Vectorized analysis of many detected clothing items at once (color palettes for wardrobe-scale uploads,
+    style and color profiles for many users in one call), plus running per-class color statistics for webcam sessions.
+'''
+
+import numpy as np
+
+from color_names import COLOR_NAMES, rgb_to_lab, parse_rgb_array, name_colors, name_indices
+
+STYLES = ["Casual", "Formal", "Classic", "Trendy", "Minimalist", "Bohemian"]
+
+# (substring of class name, points per style) - an item scores every rule its class name matches
+STYLE_RULES = [
+    ('outwear', {"Casual": 10}),
+    ('sleeve top', {"Classic": 15}),
+    ('dress', {"Formal": 20}),
+    ('trousers', {"Classic": 10, "Minimalist": 5}),
+    ('shorts', {"Casual": 15}),
+    ('skirt', {"Trendy": 10, "Bohemian": 5})
+]
+
+
+def _quantize(rgb, bits):
+    '''
+        Takes in (N, 3) uint8 array and returns (N,) int array of RGB bin ids at given bit depth.
+    '''
+
+    q = (rgb >> (8 - bits)).astype(np.int64)
+    return (q[:, 0] << (2 * bits)) | (q[:, 1] << bits) | q[:, 2]
+
+
+def _bin_centers(bin_ids, bits):
+    '''
+        Takes in array of RGB bin ids and returns (N, 3) float array of bin centers in RGB.
+    '''
+
+    mask = (1 << bits) - 1
+    step = 256 / (1 << bits)
+    q = np.stack([(bin_ids >> (2 * bits)) & mask, (bin_ids >> bits) & mask, bin_ids & mask], axis=1)
+    return (q + 0.5) * step
+
+
+def _init_centroids(points, weights, k):
+    '''
+        Deterministic farthest-point seeding: starts at heaviest point and repeatedly adds point
+        with largest weighted distance to the centroids chosen so far.
+    '''
+
+    chosen = [int(np.argmax(weights))]
+    dists = ((points - points[chosen[0]]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        idx = int(np.argmax(dists * weights))
+        if dists[idx] == 0: break # Fewer distinct colors than k
+        chosen.append(idx)
+        dists = np.minimum(dists, ((points - points[idx]) ** 2).sum(axis=1))
+
+    return points[chosen].copy()
+
+
+def weighted_kmeans(points, weights, k, iterations=10):
+    '''
+        Takes in (N, D) points, (N,) weights and cluster count. Returns (centroids, cluster weights, labels).
+        Deterministic seeding and a fixed iteration cap keep the cost bounded at O(N * k * iterations).
+    '''
+
+    centroids = _init_centroids(points, weights, k)
+    k = len(centroids)
+
+    for _ in range(iterations):
+        dists = ((points[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+        labels = np.argmin(dists, axis=1)
+
+        totals = np.bincount(labels, weights=weights, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=weights * points[:, d], minlength=k) for d in range(points.shape[1])], axis=1)
+        occupied = totals > 0
+        updated = centroids.copy()
+        updated[occupied] = sums[occupied] / totals[occupied, None]
+
+        if np.allclose(updated, centroids): break
+        centroids = updated
+
+    dists = ((points[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+    labels = np.argmin(dists, axis=1)
+    totals = np.bincount(labels, weights=weights, minlength=k)
+    return centroids, totals, labels
+
+
+def cluster_palette(rgb, weights=None, k=5, bits=5):
+    '''
+        Takes in (N, 3) array of RGB colors and optional per-item weights. Returns list of dicts with RGB centroid,
+        share of total weight and catalog color name, heaviest first.
+        Colors are first binned into a 2^(3 * bits) RGB histogram so clustering cost depends on the number of
+        distinct bins rather than the number of items, then clustered with weighted k-means in CIELAB.
+    '''
+
+    rgb = np.asarray(rgb, dtype=np.uint8).reshape(-1, 3)
+    if len(rgb) == 0: return []
+    weights = np.ones(len(rgb)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    bin_ids = _quantize(rgb, bits)
+    bins, inverse = np.unique(bin_ids, return_inverse=True)
+    bin_weights = np.bincount(inverse, weights=weights)
+
+    # Weighted mean of actual item colors in each bin (more accurate than the bin center)
+    bin_rgb = np.stack([np.bincount(inverse, weights=weights * rgb[:, d]) for d in range(3)], axis=1)
+    nonzero = bin_weights > 0
+    bin_rgb[nonzero] /= bin_weights[nonzero, None]
+    bin_rgb[~nonzero] = _bin_centers(bins[~nonzero], bits)
+
+    lab = rgb_to_lab(bin_rgb)
+    _, totals, labels = weighted_kmeans(lab, bin_weights, k)
+
+    # Centroids reported in RGB as weighted mean of member colors so they stay inside the gamut
+    centroid_rgb = np.stack([np.bincount(labels, weights=bin_weights * bin_rgb[:, d], minlength=len(totals)) for d in range(3)], axis=1)
+    occupied = totals > 0
+    centroid_rgb = np.rint(centroid_rgb[occupied] / totals[occupied, None]).astype(np.uint8)
+    totals = totals[occupied]
+
+    order = np.argsort(-totals, kind='stable')
+    total = totals.sum()
+    names = name_colors(centroid_rgb[order])
+
+    return [
+        {
+            'color': f'({int(c[0])}, {int(c[1])}, {int(c[2])})',
+            'share': float(w / total) if total > 0 else 0.0,
+            'color name': name
+        }
+        for c, w, name in zip(centroid_rgb[order], totals[order], names)
+    ]
+
+
+def item_palette(items, k=5):
+    '''
+        Takes in list of detected item dicts (with RGB string under 'color') and returns cluster_palette result for them.
+    '''
+
+    rgb, valid = parse_rgb_array([item.get('color') for item in items])
+    return cluster_palette(rgb[valid], k=k)
+
+
+def style_weights(class_names):
+    '''
+        Takes in list of class names and returns (weights, inverse) where weights is (K, len(STYLES)) matrix of style
+        points for each distinct class name and inverse maps every input name to its row. Rules are only evaluated
+        once per distinct name, so cost doesn't depend on number of items.
+    '''
+
+    unique, inverse = np.unique(np.array(class_names, dtype=str), return_inverse=True)
+    weights = np.zeros((len(unique), len(STYLES)))
+    for row, class_name in enumerate(unique):
+        class_name = class_name.lower()
+        for pattern, points in STYLE_RULES:
+            if pattern in class_name:
+                for style, value in points.items():
+                    weights[row, STYLES.index(style)] += value
+
+    return weights, inverse
+
+
+def _top_percentages(scores, labels, top):
+    '''
+        Takes in (U, L) score matrix and label list. Returns list per row of [label, percentage] for top labels
+        with positive score, percentages taken over all positive scores in the row.
+    '''
+
+    totals = scores.sum(axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')[:, :top]
+    results = []
+    for row, total in enumerate(totals):
+        entries = []
+        for col in order[row]:
+            score = scores[row, col]
+            if score <= 0: break
+            entries.append([labels[col], round((score / total) * 100)])
+        results.append(entries)
+    return results
+
+
+def style_profiles(user_index, class_names, user_count, top=3):
+    '''
+        Takes in per-item user index and class name and returns list of top style [style, percentage] lists per user.
+    '''
+
+    weights, inverse = style_weights(class_names)
+    item_weights = weights[inverse]
+    scores = np.stack([np.bincount(user_index, weights=item_weights[:, i], minlength=user_count) for i in range(len(STYLES))], axis=1)
+    return _top_percentages(scores, STYLES, top)
+
+
+def color_profiles(user_index, rgb, user_count, top=5):
+    '''
+        Takes in per-item user index and (N, 3) RGB array. Returns (dominant colors, color names) per user, where colors
+        are grouped by catalog color name: [mean RGB string, percentage] and [color name, percentage] respectively.
+    '''
+
+    names = name_indices(rgb).astype(np.int64)
+    groups = user_index * len(COLOR_NAMES) + names
+    size = user_count * len(COLOR_NAMES)
+
+    counts = np.bincount(groups, minlength=size).reshape(user_count, len(COLOR_NAMES)).astype(np.float64)
+    sums = np.stack([np.bincount(groups, weights=rgb[:, d], minlength=size) for d in range(3)], axis=1)
+    means = np.rint(sums / np.maximum(counts.reshape(-1, 1), 1)).astype(int).reshape(user_count, len(COLOR_NAMES), 3)
+
+    named = _top_percentages(counts, COLOR_NAMES, top)
+    dominant = [
+        [[f'({r}, {g}, {b})', pct] for (name, pct), (r, g, b) in zip(entries, (means[u, COLOR_NAMES.index(name)] for name, _ in entries))]
+        for u, entries in enumerate(named)
+    ]
+    return dominant, named
+
+
+def bulk_profiles(users, top_styles=3, top_colors=5):
+    '''
+        Takes in list of dicts {'user_id': ..., 'items': [{'class name': ..., 'color': '(r, g, b)'}, ...]} and returns
+        list of profile dicts in the same order. All users' items are flattened into arrays and aggregated per user
+        with grouped sums rather than looping over items.
+    '''
+
+    class_names, colors, owners = [], [], []
+    for u, user in enumerate(users):
+        for item in user.get('items', []):
+            class_names.append(item.get('class name', ''))
+            colors.append(item.get('color'))
+            owners.append(u)
+
+    user_index = np.array(owners, dtype=np.int64)
+    styles = style_profiles(user_index, class_names, len(users), top_styles) if owners else [[] for _ in users]
+
+    rgb, valid = parse_rgb_array(colors)
+    if valid.any():
+        dominant, named = color_profiles(user_index[valid], rgb[valid].astype(np.int64), len(users), top_colors)
+    else:
+        dominant, named = [[] for _ in users], [[] for _ in users]
+
+    return [
+        {
+            'user_id': user.get('user_id'),
+            'dominant_colors': dominant[u],
+            'color_names': named[u],
+            'dominant_types': styles[u]
+        }
+        for u, user in enumerate(users)
+    ]
+
+
+class ColorAccumulator:
+    '''
+        Running per-class color distributions built up frame by frame. Each detection adds a subsampled histogram of
+        the pixels in its box, weighted by confidence, so the final color reflects every frame the item was seen in.
+        Reading a class's color only clusters its histogram bins, so the cost doesn't grow with session length.
+    '''
+
+    def __init__(self, bits=4, max_samples=1024):
+        self.bits = bits
+        self.max_samples = max_samples
+        self.bins = 1 << (3 * bits)
+        self.counts = {} # Class name -> (bins,) accumulated weights
+        self.sums = {} # Class name -> (bins, 3) accumulated weighted RGB, so bins report their mean color rather than center
+
+    def add(self, class_name, frame, bbox, weight=1.0, bgr=True):
+        '''
+            Takes in class name, frame (BGR from OpenCV unless bgr=False), (x1, y1, x2, y2) box and detection weight
+            and adds box's pixels to class's distribution. Pixels are sampled on a grid of at most max_samples points.
+        '''
+
+        height, width = frame.shape[:2]
+        x1, y1, x2, y2 = (int(v) for v in bbox)
+        crop = frame[max(y1, 0):min(y2, height), max(x1, 0):min(x2, width)]
+        if crop.size == 0: return
+
+        step = max(1, int(np.sqrt(crop.shape[0] * crop.shape[1] / self.max_samples)))
+        pixels = crop[::step, ::step].reshape(-1, 3)
+        if bgr:
+            pixels = pixels[:, ::-1]
+
+        bin_ids = _quantize(pixels, self.bits)
+        if class_name not in self.counts:
+            self.counts[class_name] = np.zeros(self.bins)
+            self.sums[class_name] = np.zeros((self.bins, 3))
+
+        self.counts[class_name] += np.bincount(bin_ids, minlength=self.bins) * weight
+        for d in range(3):
+            self.sums[class_name][:, d] += np.bincount(bin_ids, weights=pixels[:, d].astype(np.float64), minlength=self.bins) * weight
+
+    def color(self, class_name, k=5):
+        '''
+            Takes in class name and returns RGB string of its dominant color (largest of k clusters), or None if the
+            class was never seen.
+        '''
+
+        counts = self.counts.get(class_name)
+        if counts is None: return None
+
+        occupied = np.flatnonzero(counts)
+        if len(occupied) == 0: return None
+        rgb = np.rint(self.sums[class_name][occupied] / counts[occupied, None]).astype(np.uint8)
+        return cluster_palette(rgb, counts[occupied], k=k)[0]['color']
+
+    def clear(self):
+        self.counts.clear()
+        self.sums.clear()